@@ -24,24 +24,42 @@ TODO:
 - build with go!?
 """
 
+import bz2
+import calendar
+import csv
+import difflib
+import glob
+import gzip
+import hashlib
+import heapq
 import itertools
+import json
 import logging
+import lzma
+import math
+import operator
 import os
 import re
+import shutil
 import subprocess
+import sys
+import tempfile
 import typing as t
-from collections import defaultdict
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from configparser import ConfigParser
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
 from datetime import date, datetime, time, timedelta
-from functools import partial
+from functools import lru_cache, partial
 from itertools import count
 from pathlib import Path
-from time import mktime, sleep
+from time import perf_counter, sleep
+from urllib.parse import unquote, urlparse
 
 import pytimeparse
 import typer
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
 from rich import box
 from rich.console import Console
 from rich.live import Live
@@ -60,6 +78,7 @@ DATE_FORMAT_DISPLAY = "%a, %d.%m."
 
 RE_PROJECT = re.compile(r"(?:^|\s)\+(?P<name>\w+)")
 RE_CONTEXT = re.compile(r"(?:^|\s)\@(?P<name>\w+)")
+RE_TAG = re.compile(r"(?:^|\s)\#(?P<name>\w+)")
 
 
 class TTrackFileMeta(BaseModel):
@@ -75,6 +94,64 @@ class TTrackWorkdayMeta(TTrackFileMeta):
     pass
 
 
+class TTrackFileTable:
+    # every parsed item refers to its file by a small integer id instead
+    # of holding its own Path object.
+
+    def __init__(self):
+        self._files: list[Path] = []
+        self._ids: dict[Path, int] = {}
+
+    def intern(self, file: Path) -> int:
+        try:
+            return self._ids[file]
+        except KeyError:
+            self._files.append(file)
+            return self._ids.setdefault(file, len(self._files) - 1)
+
+    def resolve(self, file_id: int) -> Path:
+        return self._files[file_id]
+
+
+FILES = TTrackFileTable()
+
+SOURCE_LINE_BITS: t.Final[int] = 32
+SOURCE_LINE_MASK: t.Final[int] = (1 << SOURCE_LINE_BITS) - 1
+
+
+def pack_source(file: Path, line: int) -> int:
+    if not 0 <= line <= SOURCE_LINE_MASK:
+        raise ValueError(f"line number out of range: {line}")
+    return FILES.intern(file) << SOURCE_LINE_BITS | line
+
+
+def unpack_source(source: int) -> t.Tuple[Path, int]:
+    return FILES.resolve(source >> SOURCE_LINE_BITS), source & SOURCE_LINE_MASK
+
+
+class TTrackSourced(BaseModel):
+    META_CLASS: t.ClassVar[type[TTrackFileMeta]] = TTrackFileMeta
+
+    # file id and line number packed into one int, see pack_source
+    source: int = 0
+
+    @model_validator(mode="before")
+    @classmethod
+    def pack_meta(cls, data: t.Any) -> t.Any:
+        if isinstance(data, dict) and "meta" in data:
+            data = dict(data)
+            meta = data.pop("meta")
+            if isinstance(meta, TTrackFileMeta):
+                meta = meta.model_dump()
+            data["source"] = pack_source(Path(meta["file"]), meta["line"])
+        return data
+
+    @property
+    def meta(self) -> TTrackFileMeta:
+        file, line = unpack_source(self.source)
+        return self.META_CLASS(file=file, line=line)
+
+
 DoneFlag: t.TypeAlias = t.Literal["x", "_"]
 BillableFlag: t.TypeAlias = t.Literal["$", "€", "-"]
 
@@ -97,6 +174,8 @@ def format_timedelta(td: timedelta) -> str:
 
 
 class TTrackTimeItem(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     raw: str
     time: timedelta
 
@@ -121,8 +200,9 @@ class TTrackEndTime(TTrackTime):
     SYMBOL: t.Literal["<"] = "<"
 
 
-class TTrackWorkday(BaseModel):
-    meta: TTrackWorkdayMeta
+class TTrackWorkday(TTrackSourced):
+    META_CLASS: t.ClassVar[type[TTrackFileMeta]] = TTrackWorkdayMeta
+
     date: date
     time: TTrackStartTime | TTrackEndTime
 
@@ -132,8 +212,9 @@ class TTrackWorkday(BaseModel):
         )
 
 
-class TTrackItem(BaseModel):
-    meta: TTrackItemMeta
+class TTrackItem(TTrackSourced):
+    META_CLASS: t.ClassVar[type[TTrackFileMeta]] = TTrackItemMeta
+
     done: None | DoneFlag
     billable: None | BillableFlag
     date: date
@@ -146,17 +227,14 @@ class TTrackItem(BaseModel):
     def is_done(self) -> bool:
         return self.done in t.get_args(DoneFlag)
 
-    def to_line(self, sep: str = "\t") -> str:
+    def to_line(self, sep: str = "\t", with_date: bool = True) -> str:
         parts = []
         if self.done is not None:
             parts.append(self.done)
-        else:
-            parts.append("_")
         if self.billable is not None:
             parts.append(self.billable)
-        else:
-            parts.append("_")
-        parts.append(self.date.strftime(DATE_FORMAT))
+        if with_date:
+            parts.append(self.date.strftime(DATE_FORMAT))
         parts.append(self.time.format())
         parts.append(self.text)
         return sep.join(parts)
@@ -187,6 +265,10 @@ class TTrackItem(BaseModel):
             return match.group("name").strip()
         return None
 
+    @property
+    def tags(self) -> list[str]:
+        return list(dict.fromkeys(RE_TAG.findall(self.text)))
+
 
 class TTrackRawItem(t.TypedDict):
     done: None | DoneFlag
@@ -243,7 +325,7 @@ def parser_date(line: str) -> t.Tuple[TTKey, date | None, str]:
 def parser_time(line: str) -> t.Tuple[TTKey, TTrackTimeItemRaw, str]:
     # improve, replace pytimeparse
     key = "time"
-    val, rest = line.split(" ", 1)
+    val, _, rest = line.partition(" ")
     if value := pytimeparse.parse(val):
         return key, {"time": timedelta(seconds=value), "raw": val}, rest.strip(" ")
     if re.match(r"\.+", val):
@@ -256,16 +338,13 @@ def parser_time(line: str) -> t.Tuple[TTKey, TTrackTimeItemRaw, str]:
         start, end = val.split("-")
     except ValueError:
         return key, {"time": timedelta(seconds=0), "raw": "0m"}, line
-    else:
-        return (
-            key,
-            {
-                "time": datetime.strptime(end, "%H:%M")
-                - datetime.strptime(start, "%H:%M"),
-                "raw": val,
-            },
-            rest.strip(" "),
+    try:
+        time_range = datetime.strptime(end, TIME_FORMAT) - datetime.strptime(
+            start, TIME_FORMAT
         )
+    except ValueError as error:
+        raise ValueError(f"invalid time range: {val!r}") from error
+    return key, {"time": time_range, "raw": val}, rest.strip(" ")
 
 
 def parser_date_or_context(
@@ -277,10 +356,14 @@ def parser_date_or_context(
     return parser_date(line)
 
 
+def strip_flags(line: str) -> str:
+    return parser_billable(parser_done(line.strip())[2])[2]
+
+
 def parse_line(line: str, context: dict[TTKey, OptionalTTValue] | None = None) -> dict:
     context = context or {}
 
-    dparse = partial(parser_date_or_context, fallback=context["prev_date"])
+    dparse = partial(parser_date_or_context, fallback=context.get("prev_date"))
 
     parsers: list[ParserFunc | None] = [
         parser_done,
@@ -304,55 +387,242 @@ def parse_workday_time(line: str) -> TTrackStartTime | TTrackEndTime:
     klass = TTrackStartTime if line[0] == ">" else TTrackEndTime
     line = line[1:]
     line = line.strip()
-    return klass(time=datetime.strptime(line, TIME_FORMAT).time())
+    try:
+        return klass(time=datetime.strptime(line, TIME_FORMAT).time())
+    except ValueError as error:
+        raise ValueError(f"invalid workday time: {line!r}") from error
+
+
+class TTrackDiagnostic(BaseModel):
+    file: Path
+    line: int
+    severity: t.Literal["error", "warning"] = "error"
+    message: str
+
+    def format(self) -> str:
+        return f"{self.file}:{self.line}: {self.severity}: {self.message}"
+
+
+class TTrackParseError(RuntimeError):
+    def __init__(self, diagnostic: TTrackDiagnostic):
+        super().__init__(diagnostic.format())
+        self.diagnostic = diagnostic
 
 
-def parse_file(file: Path) -> list[TTrackItem | TTrackWorkday]:
+def format_parse_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            "{}: {}".format(".".join(map(str, err["loc"])), err["msg"])
+            for err in error.errors()
+        )
+    return str(error)
+
+
+def parse_stream_line(
+    line: str, source: int, context: dict[TTKey, OptionalTTValue]
+) -> TTrackItem | TTrackWorkday | None:
+    if not line.strip() or line.strip().startswith("//"):
+        return None
+    match parser_date(line.strip()):
+        case ("date", date() as ctx_date, ""):
+            context["date"] = ctx_date
+            return None
+    if not line.startswith("  ") and "date" in context:
+        del context["date"]
+    if line.startswith("  >") or line.startswith("  <"):
+        try:
+            date_ = context["date"]
+        except KeyError as error:
+            raise RuntimeError(
+                "you cannot add workday outside of date context."
+            ) from error
+        return TTrackWorkday(
+            source=source,
+            date=t.cast(date, date_),
+            time=parse_workday_time(line),
+        )
+    line = line.strip()
+    # identical lines share one validated item. the date never takes part
+    # in the key: it is taken out of the line and rebound on the copy.
+    rest = strip_flags(line)
+    if "date" in context:
+        dated_by, date_ = "context", context["date"]
+    elif rest.startswith("*"):
+        dated_by, date_ = "previous", context.get("prev_date")
+    else:
+        _, date_, undated = parser_date(rest)
+        dated_by = "previous"
+        if date_ is not None:
+            line = f"{line[: len(line) - len(rest)]}* {undated}"
+    if date_ is None:
+        return TTrackItem.model_validate(
+            {"source": source, **parse_line(line, context)}
+        )
+    item = parse_item_cached(line, dated_by)
+    return item.model_copy(update={"source": source, "date": date_})
+
+
+PARSE_CACHE_SIZE: t.Final[int] = 4096
+PARSE_CACHE_DATE: t.Final[date] = date.min
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_item_cached(
+    line: str, dated_by: t.Literal["context", "previous"]
+) -> TTrackItem:
+    # the returned item is shared, callers only ever hand out copies.
+    context: dict[TTKey, OptionalTTValue] = {"prev_date": PARSE_CACHE_DATE}
+    if dated_by == "context":
+        context["date"] = PARSE_CACHE_DATE
+    return TTrackItem.model_validate(parse_line(line, context))
+
+
+def parse_stream(
+    lines: t.Iterable[str],
+    file: Path,
+    diagnostics: list[TTrackDiagnostic] | None = None,
+    start: int = 1,
+    prev_date: date | None = None,
+) -> list[TTrackItem | TTrackWorkday]:
+    # without a diagnostics list the first broken line raises, with one
+    # the line is recorded and skipped.
     result: list[TTrackItem | TTrackWorkday] = []
-    with file.open("r") as fhandle:
-        line_no = 0
-        context: dict[TTKey, OptionalTTValue] = {}
-        while line := fhandle.readline():
-            line_no += 1
-            if not line.strip() or line.strip().startswith("//"):
-                continue
-            match parser_date(line.strip()):
-                case ("date", date() as ctx_date, ""):
-                    context["date"] = ctx_date
-                    continue
-            if not line.startswith("  ") and "date" in context:
-                del context["date"]
-            if line.startswith("  >") or line.startswith("  <"):
-                try:
-                    date_ = context["date"]
-                except KeyError as error:
-                    raise RuntimeError(
-                        "you cannot add workday outside of date context."
-                    ) from error
-                item = TTrackWorkday(
-                    date=t.cast(date, date_),
-                    time=parse_workday_time(line),
-                    meta=TTrackWorkdayMeta(
-                        file=file,
-                        line=line_no,
-                    ),
-                )
-                context["prev_date"] = item.date
-                result.append(item)
-                continue
-            else:
-                line = line.strip()
-            item = TTrackItem.model_validate(
-                {
-                    "meta": {
-                        "file": file,
-                        "line": line_no,
-                    },
-                    **parse_line(line, context),
-                },
+    context: dict[TTKey, OptionalTTValue] = {}
+    if prev_date is not None:
+        context["prev_date"] = prev_date
+    source = pack_source(file, 0)
+    for line_no, line in enumerate(lines, start):
+        try:
+            item = parse_stream_line(line, source | line_no, context)
+        except (ValueError, OverflowError, RuntimeError) as error:
+            diagnostic = TTrackDiagnostic(
+                file=file, line=line_no, message=format_parse_error(error)
             )
-            context["prev_date"] = item.date
-            result.append(item)
+            if diagnostics is None:
+                raise TTrackParseError(diagnostic) from error
+            diagnostics.append(diagnostic)
+            continue
+        if item is None:
+            continue
+        context["prev_date"] = item.date
+        result.append(item)
+    return result
+
+
+COMPRESSIONS: t.Final[dict[str, t.Any]] = {
+    ".gz": gzip,
+    ".xz": lzma,
+    ".bz2": bz2,
+}
+
+
+def is_compressed(file: Path) -> bool:
+    return file.suffix in COMPRESSIONS
+
+
+def open_timefile(file: Path) -> t.TextIO:
+    if module := COMPRESSIONS.get(file.suffix):
+        return module.open(file, "rt")
+    return file.open("r")
+
+
+def prefer_plain(files: t.Iterable[Path]) -> list[Path]:
+    # a month that is still there uncompressed wins over its archive
+    months: dict[Path, Path] = {}
+    for file in sorted(files, key=lambda file: (is_compressed(file), file)):
+        month = file.with_suffix("") if is_compressed(file) else file
+        if month in months:
+            LOG.warning("ignoring %s, %s exists", file, months[month])
+            continue
+        months[month] = file
+    return sorted(months.values())
+
+
+def parse_file(
+    file: Path,
+    diagnostics: list[TTrackDiagnostic] | None = None,
+    max_workers: int | None = None,
+) -> list[TTrackItem | TTrackWorkday]:
+    # max_workers=1 inside pool workers, their pool already uses the cpus
+    with open_timefile(file) as fhandle:
+        lines = fhandle.readlines()
+    return parse_lines_parallel(lines, file, diagnostics, max_workers)
+
+
+PARALLEL_MIN_LINES: t.Final[int] = 20_000
+PARALLEL_CHUNKS_PER_WORKER: t.Final[int] = 4
+
+
+def is_chunk_boundary(line: str) -> bool:
+    # a top-level line drops the date context. "*" lines still lean on the
+    # previous entry, blank lines and comments keep the context.
+    if line.startswith("  ") or not line.strip() or line.lstrip().startswith("//"):
+        return False
+    return not strip_flags(line).startswith("*")
+
+
+def split_chunks(lines: t.Sequence[str], count: int) -> list[int]:
+    size = max(1, len(lines) // count)
+    starts = [0]
+    for index in range(size, len(lines), size):
+        index = max(index, starts[-1] + 1)
+        while index < len(lines) and not is_chunk_boundary(lines[index]):
+            index += 1
+        if index < len(lines):
+            starts.append(index)
+    return starts
+
+
+def parse_chunk(
+    lines: list[str], file: Path, start: int, prev_date: date | None = None
+) -> t.Tuple[list[TTrackItem | TTrackWorkday], list[TTrackDiagnostic]]:
+    diagnostics: list[TTrackDiagnostic] = []
+    return parse_stream(lines, file, diagnostics, start, prev_date), diagnostics
+
+
+def parse_lines_parallel(
+    lines: list[str],
+    file: Path,
+    diagnostics: list[TTrackDiagnostic] | None = None,
+    max_workers: int | None = None,
+) -> list[TTrackItem | TTrackWorkday]:
+    workers = max_workers or os.process_cpu_count() or 1
+    if workers < 2 or len(lines) < PARALLEL_MIN_LINES:
+        return parse_stream(lines, file, diagnostics)
+    starts = split_chunks(lines, workers * PARALLEL_CHUNKS_PER_WORKER)
+    chunks = [lines[a:b] for a, b in itertools.pairwise([*starts, len(lines)])]
+    first_lines = [start + 1 for start in starts]
+    # threads only scale without the GIL, otherwise the chunks go to
+    # processes and come back with file ids of the child's FILES table.
+    threaded = not sys._is_gil_enabled()
+    file_bits = pack_source(file, 0)
+    executor_class = ThreadPoolExecutor if threaded else ProcessPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        parsed = list(
+            executor.map(parse_chunk, chunks, itertools.repeat(file), first_lines)
+        )
+
+    result: list[TTrackItem | TTrackWorkday] = []
+    errors: list[TTrackDiagnostic] = []
+    for chunk, first_line, (items, chunk_errors) in zip(chunks, first_lines, parsed):
+        if not threaded:
+            for item in items:
+                item.source = file_bits | item.source & SOURCE_LINE_MASK
+        # lines before the first entry of a chunk did not see the date of
+        # the previous chunk, broken ones are parsed again with it.
+        first_item = items[0].source & SOURCE_LINE_MASK if items else None
+        if (
+            result
+            and chunk_errors
+            and (first_item is None or chunk_errors[0].line < first_item)
+        ):
+            items, chunk_errors = parse_chunk(chunk, file, first_line, result[-1].date)
+        result.extend(items)
+        errors.extend(chunk_errors)
+    if diagnostics is None and errors:
+        raise TTrackParseError(errors[0])
+    if diagnostics is not None:
+        diagnostics.extend(errors)
     return result
 
 
@@ -365,7 +635,15 @@ def measure_time():
 
     start = time.time()
     yield
-    print("time", time.time() - start)
+    print("time", time.time() - start, file=sys.stderr)
+    cache = parse_item_cached.cache_info()
+    lookups = cache.hits + cache.misses
+    print(
+        "parse cache",
+        f"hits={cache.hits} misses={cache.misses} size={cache.currsize}",
+        f"hit rate={cache.hits / lookups if lookups else 0:.1%}",
+        file=sys.stderr,
+    )
 
 
 # -------------------------------------------------
@@ -387,12 +665,24 @@ class TTrackRepository:
         self.load()
 
     def load(self):
-        self._data = parse_file(self.timefile)
+        self.diagnostics: list[TTrackDiagnostic] = []
+        self._data = parse_file(self.timefile, self.diagnostics)
+        self._index: TTrackIndex | None = None
+        for diagnostic in self.diagnostics:
+            LOG.warning(diagnostic.format())
+
+    @property
+    def index(self) -> "TTrackIndex":
+        if self._index is None:
+            self._index = TTrackIndex(self._data)
+        return self._index
 
     def add(self, line: list[str] | TTrackItem | TTrackRawItem):
         if isinstance(line, (dict, TTrackItem)):
             # TODO: implement
             raise NotImplementedError("not yet implemented")
+        if is_compressed(self.timefile):
+            raise RuntimeError(f"{self.timefile} is an archive and cannot be written.")
         with self.timefile.open("a") as fhandle:
             fhandle.writelines([os.linesep, " ".join(line).strip()])
 
@@ -457,6 +747,31 @@ class TTrackContextObj:
             timefile.touch()
         return timefile
 
+    def get_archive_files(self) -> list[Path]:
+        # the timefile pattern with every date placeholder as wildcard
+        pattern = self.config.get(
+            "timetrack",
+            "timefile",
+            vars={"tt_year": "*", "tt_month": "*", "tt_day": "*"},
+        )
+        files = prefer_plain(
+            Path(name)
+            for suffix in ("", *COMPRESSIONS)
+            for name in glob.glob(pattern + suffix)
+        )
+        return sorted({*files, self.get_timefile()})
+
+    def get_cachedir(self) -> Path:
+        cachedir_name = self.config.get(
+            "timetrack",
+            "cachedir",
+            fallback=str(Path.home() / ".cache" / "timetrack.txt"),
+        )
+        cachedir = Path(cachedir_name)
+        if not cachedir.exists():
+            cachedir.mkdir(parents=True)
+        return cachedir
+
     def get_hookdir(self) -> Path:
         hookdir_name = self.config.get("timetrack", "hookdir")
         hookdir = Path(hookdir_name.format(**self._get_timefile_name_context()))
@@ -486,6 +801,77 @@ class TTrackContextObj:
         time_per_day = self.config.get("timetrack", "time_per_day", fallback="5h")
         return timedelta(seconds=pytimeparse.parse(time_per_day))
 
+    def get_workdays(self) -> list[int]:
+        workdays = self.config.get(
+            "timetrack", "workdays", fallback="mon,tue,wed,thu,fri"
+        )
+        return [WEEKDAYS.index(day.strip().lower()[:3]) for day in workdays.split(",")]
+
+    def get_balance_start(self, ledger: "TTrackLedger") -> date | None:
+        if balance_start := self.config.get("timetrack", "balance_start", fallback=""):
+            return datetime.strptime(balance_start, DATE_FORMAT).date()
+        return ledger.first_day()
+
+    def get_ledger(self) -> "TTrackLedger":
+        ledger_file = self.get_cachedir() / "ledger.json"
+        time_per_day, workdays = self.get_time_per_day(), self.get_workdays()
+        ledger = TTrackLedger(time_per_day, workdays)
+        if ledger_file.exists():
+            try:
+                ledger = TTrackLedger.from_dict(
+                    json.loads(ledger_file.read_text()), time_per_day, workdays
+                )
+            except (ValueError, KeyError):
+                LOG.warning("ignoring broken ledger %s", ledger_file)
+        changed = ledger.update(self.get_archive_files())
+        checkpoints = len(ledger.prefix)
+        if ledger.base is not None:
+            # checkpoint every closed month
+            ledger.months_delta(ledger.base, month_index(date.today()) - 1)
+        if changed or len(ledger.prefix) != checkpoints:
+            ledger_file.write_text(json.dumps(ledger.to_dict()))
+        return ledger
+
+    def get_timefile_for(self, day: date) -> Path:
+        return Path(
+            self.config.get(
+                "timetrack",
+                "timefile",
+                vars={
+                    "tt_year": day.strftime("%Y"),
+                    "tt_month": day.strftime("%m"),
+                    "tt_day": day.strftime("%d"),
+                },
+            )
+        )
+
+    def get_import_rules(self) -> "TTrackImportRules":
+        defaults = self.config.defaults()
+
+        def section(name: str) -> dict[str, str]:
+            if not self.config.has_section(name):
+                return {}
+            return {
+                key: value
+                for key, value in self.config.items(name, raw=True)
+                if key not in defaults
+            }
+
+        settings = section("import")
+        return TTrackImportRules(
+            projects=section("import:project"),
+            contexts=section("import:context"),
+            billable_projects={
+                name.strip()
+                for name in settings.get("billable_projects", "").split(",")
+                if name.strip()
+            },
+            date_format=settings.get("date_format") or None,
+        )
+
+    def get_compact_comments(self) -> str:
+        return self.config.get("timetrack", "compact_comments", fallback="keep")
+
     def apply_hook(self, prefix: str, context: dict) -> dict:
         hooks_to_call = sorted(
             [hook for hook in self.config.options("hooks") if hook.startswith(prefix)]
@@ -531,7 +917,10 @@ def root_callback(
     config_file: Annotated[
         str | None, typer.Option("-c", "--config", envvar="TT_CONFIG_FILE")
     ] = None,
+    profile: Annotated[bool, typer.Option("--profile", is_flag=True)] = False,
 ):
+    if profile:
+        ctx.with_resource(measure_time())
     ctx.obj = TTrackContextObj(config_file)
     logging.basicConfig(
         filename=ctx.obj.get_log_file(),
@@ -574,27 +963,139 @@ class TTrackBaseItem(t.Protocol):
     def date(self) -> date: ...
 
 
-def to_unix_timestamp(value: date | datetime) -> int:
-    return int(mktime(value.timetuple()))
+def group_by_day(item: TTrackBaseItem) -> int:
+    return item.date.toordinal()
 
 
-def group_by_day(item: TTrackBaseItem) -> int:
-    return to_unix_timestamp(item.date)
+def group_by_week(item: TTrackBaseItem) -> int:
+    # ordinal 1 (0001-01-01) is a monday, so this counts iso weeks
+    return (item.date.toordinal() - 1) // 7
+
+
+def group_by_month(item: TTrackBaseItem) -> int:
+    return item.date.year * 12 + item.date.month - 1
+
+
+def group_by_year(item: TTrackBaseItem) -> int:
+    return item.date.year
+
 
+def group_by_project(item: TTrackBaseItem) -> str | None:
+    return item.project if isinstance(item, TTrackItem) else None
 
-def group_by_week(time: TTrackBaseItem) -> str:
-    return time.date.strftime("%Y%U")
 
+def group_by_context(item: TTrackBaseItem) -> str | None:
+    return item.context if isinstance(item, TTrackItem) else None
 
-GROUP_FUNCTIONS = {
+
+def group_by_tag(item: TTrackBaseItem) -> tuple[str | None, ...]:
+    if isinstance(item, TTrackItem) and (tags := item.tags):
+        return tuple(tags)
+    return (None,)
+
+
+def group_by_billable(item: TTrackBaseItem) -> bool:
+    return isinstance(item, TTrackItem) and item.is_billable()
+
+
+GROUP_FUNCTIONS: dict[str, t.Callable[[t.Any], t.Any]] = {
     "day": group_by_day,
     "week": group_by_week,
+    "month": group_by_month,
+    "year": group_by_year,
+    "project": group_by_project,
+    "context": group_by_context,
+    "tag": group_by_tag,
+    "billable": group_by_billable,
 }
 
+# group functions returning several keys, the item is counted in each group
+FANOUT_GROUPS: t.Final[frozenset[str]] = frozenset({"tag"})
+
+
+def parse_group(group: str) -> list[str]:
+    keys = [key.strip() for key in group.split(",") if key.strip()]
+    if not keys:
+        raise ValueError("no group given.")
+    for key in keys:
+        if key not in GROUP_FUNCTIONS:
+            raise ValueError(
+                f"unknown group {key!r}, use one of {', '.join(GROUP_FUNCTIONS)}."
+            )
+    return keys
+
+
+def iter_group_keys(item: TTrackBaseItem, keys: list[str]) -> t.Iterator[tuple]:
+    if FANOUT_GROUPS.isdisjoint(keys):
+        yield tuple(GROUP_FUNCTIONS[key](item) for key in keys)
+        return
+    yield from itertools.product(
+        *(
+            GROUP_FUNCTIONS[key](item)
+            if key in FANOUT_GROUPS
+            else (GROUP_FUNCTIONS[key](item),)
+            for key in keys
+        )
+    )
+
+
+def sort_group_key(key: tuple) -> tuple:
+    return tuple((value is None, value) for value in key)
+
+
+def group_items(
+    items: t.Iterable[TTrackItem | TTrackWorkday], keys: list[str]
+) -> dict[tuple, list[TTrackItem | TTrackWorkday]]:
+    groups: dict[tuple, list[TTrackItem | TTrackWorkday]] = defaultdict(list)
+    for item in items:
+        for key in iter_group_keys(item, keys):
+            groups[key].append(item)
+    return {key: groups[key] for key in sorted(groups, key=sort_group_key)}
+
+
+def aggregate_time(
+    items: t.Iterable[TTrackItem | TTrackWorkday], keys: list[str]
+) -> dict[tuple, timedelta]:
+    totals: dict[tuple, timedelta] = defaultdict(timedelta)
+    for item in items:
+        if not isinstance(item, TTrackItem):
+            continue
+        for key in iter_group_keys(item, keys):
+            totals[key] += item.time.time
+    return {key: totals[key] for key in sorted(totals, key=sort_group_key)}
+
+
+def format_group_value(key: str, value: t.Any) -> str:
+    if value is None:
+        return "-"
+    match key:
+        case "day":
+            return date.fromordinal(value).strftime(DATE_FORMAT_DISPLAY)
+        case "week":
+            year, week, _ = date.fromordinal(value * 7 + 1).isocalendar()
+            return f"{year}-W{week:02}"
+        case "month":
+            year, month = divmod(value, 12)
+            return f"{year}-{month + 1:02}"
+        case "billable":
+            return "$" if value else "-"
+    return str(value)
+
+
+def format_group_key(keys: list[str], values: tuple) -> str:
+    return " ".join(format_group_value(k, v) for k, v in zip(keys, values))
+
 
 class SummaryTable:
-    def __init__(self, repository: TTrackRepository):
+    def __init__(
+        self,
+        repository: TTrackRepository,
+        ledger: "TTrackLedger | None" = None,
+        balance_start: date | None = None,
+    ):
         self.repository = repository
+        self.ledger = ledger
+        self.balance_start = balance_start
 
         table = Table(box=box.MINIMAL, padding=(0, 1))
         table.add_column("#", justify="right")
@@ -607,6 +1108,8 @@ class SummaryTable:
         table.add_column("text")
         table.add_column("project", justify="right")
         table.add_column("context", justify="right")
+        if ledger is not None:
+            table.add_column("balance", justify="right")
         self.table = table
 
     def load(self, timespan: str, group: str, reload: bool = False):
@@ -618,9 +1121,10 @@ class SummaryTable:
             self.repository.load()
         all_items = self.repository.list(filter_options)
 
-        grouped_items = itertools.groupby(all_items, GROUP_FUNCTIONS[group])
+        group_keys = parse_group(group)
+        grouped_items = group_items(all_items, group_keys)
 
-        for _, items in grouped_items:
+        for group_key, items in grouped_items.items():
             billable = timedelta(seconds=0)
             overall = timedelta(seconds=0)
 
@@ -672,7 +1176,7 @@ class SummaryTable:
             if current_wd_item is not None:
                 worktime += current_wd_item.diff(
                     TTrackWorkday(
-                        meta=TTrackWorkdayMeta(file=Path("."), line=-1),
+                        meta=TTrackWorkdayMeta(file=Path("."), line=0),
                         date=date.today(),
                         time=TTrackEndTime(time=datetime.now().time()),
                     )
@@ -694,6 +1198,9 @@ class SummaryTable:
                     end_section=False,
                 )
 
+            balance = []
+            if self.ledger is not None:
+                balance.append(self.format_balance(max(item.date for item in items)))
             self.table.add_row(
                 "",
                 "",
@@ -702,13 +1209,19 @@ class SummaryTable:
                 "",
                 format_timedelta(worktime),
                 format_timedelta(overall),
+                format_group_key(group_keys, group_key),
                 "",
                 "",
-                "",
+                *balance,
                 style="blue bold",
                 end_section=True,
             )
 
+    def format_balance(self, until: date) -> str:
+        if self.ledger is None or self.balance_start is None:
+            return ""
+        return format_balance(self.ledger.balance(self.balance_start, until))
+
 
 @app.command("ls")
 @app.command("list")
@@ -718,10 +1231,17 @@ def cmd_summary(
     timespan: Annotated[str, typer.Argument()] = TIMESPAN_TODAY,
     group: Annotated[str, typer.Option("-g", "--group")] = "day",
     watch: Annotated[bool, typer.Option("-w", is_flag=True)] = False,
+    balance: Annotated[bool, typer.Option("--balance", is_flag=True)] = False,
 ):
     ctx_obj: TTrackContextObj = ctx.obj
+    try:
+        parse_group(group)
+    except ValueError as error:
+        raise typer.BadParameter(str(error), param_hint="--group") from error
+    ledger = ctx_obj.get_ledger() if balance else None
+    balance_start = ctx_obj.get_balance_start(ledger) if ledger else None
     if watch:
-        table = SummaryTable(ctx_obj.repository)
+        table = SummaryTable(ctx_obj.repository, ledger, balance_start)
         table.load(timespan, group)
 
         live = Live(table.table, auto_refresh=False, console=CONSOLE)
@@ -731,7 +1251,11 @@ def cmd_summary(
         class Handler(PatternMatchingEventHandler):
             def on_modified(self, event: FileSystemEvent) -> None:
                 ctx_obj.repository.load()
-                table = SummaryTable(ctx_obj.repository)
+                table = SummaryTable(
+                    ctx_obj.repository,
+                    ctx_obj.get_ledger() if balance else None,
+                    balance_start,
+                )
                 table.load(timespan, group)
                 live.update(table.table)
                 live.refresh()
@@ -753,7 +1277,7 @@ def cmd_summary(
             ob.stop()
             live.stop()
     else:
-        table = SummaryTable(ctx_obj.repository)
+        table = SummaryTable(ctx_obj.repository, ledger, balance_start)
         table.load(timespan, group)
         CONSOLE.print(table.table)
 
@@ -802,34 +1326,40 @@ def squash_cmd(
     ctx_obj: TTrackContextObj = ctx.obj
     filter_options = timespan_to_filter_options(timespan)
     all_items = ctx_obj.repository.list(filter_options)
-    grouped_items = itertools.groupby(all_items, GROUP_FUNCTIONS[group])
+    try:
+        group_keys = parse_group(group)
+    except ValueError as error:
+        raise typer.BadParameter(str(error), param_hint="--group") from error
     time_per_day = ctx_obj.get_time_per_day()
 
-    data = defaultdict(lambda: defaultdict(lambda: timedelta(seconds=0)))
-    for group, items in grouped_items:
-        for item in items:
-            if not isinstance(item, TTrackItem):
-                continue
-            data[item.date][item.project] += item.time.time
+    # the last key is listed per row, the others make up a section
+    if "project" not in group_keys:
+        group_keys = [*group_keys, "project"]
+    section_keys, row_key = group_keys[:-1], group_keys[-1]
+    totals = aggregate_time(all_items, group_keys)
 
     table = Table(box=box.MINIMAL, padding=(0, 1))
     table.add_column("#", justify="right")
-    table.add_column("date")
-    table.add_column("project")
+    table.add_column(",".join(section_keys) or "group")
+    table.add_column(row_key)
     table.add_column("time")
 
     row_id = count()
-    for group, data in data.items():
+    sections = itertools.groupby(totals.items(), key=lambda entry: entry[0][:-1])
+    for section, rows in sections:
         current = timedelta(seconds=0)
-        for project, time_ in data.items():
+        for key, time_ in rows:
             table.add_row(
                 str(next(row_id)),
-                group.strftime(DATE_FORMAT_DISPLAY),
-                project,
+                format_group_key(section_keys, section),
+                format_group_value(row_key, key[-1]),
                 format_timedelta(time_),
             )
             current += time_
-        row_color = "green" if time_ >= time_per_day else "yellow"
+        if section_keys == ["day"]:
+            row_color = "green" if current >= time_per_day else "yellow"
+        else:
+            row_color = "blue"
         table.add_row(
             "",
             "",
@@ -842,5 +1372,2080 @@ def squash_cmd(
     CONSOLE.print(table)
 
 
+COMPACT_COMMENTS: t.Final[tuple[str, ...]] = ("keep", "drop", "normalize")
+
+RE_COMMENT = re.compile(r"^(?P<indent>\s*)//\s*(?P<text>.*?)\s*$")
+
+
+def compact_key(item: TTrackItem) -> t.Tuple[date, str | None, str | None, str]:
+    # project and context are part of the text, so the text covers both
+    return item.date, item.done, item.billable, " ".join(item.text.split())
+
+
+def render_compacted(
+    item: TTrackItem, total: timedelta, in_date_context: bool
+) -> str | None:
+    # timefiles hold whole minutes and "0m" is no duration to the parser,
+    # a group is only merged if its line reads back to the same entry.
+    if total <= timedelta(0) or total % timedelta(minutes=1):
+        return None
+    compacted = item.model_copy(
+        update={"time": TTrackTimeItem(raw=format_timedelta(total), time=total)}
+    )
+    line = compacted.to_line(sep=" ", with_date=not in_date_context)
+    context: dict[TTKey, OptionalTTValue] = {"prev_date": item.date}
+    if in_date_context:
+        context["date"] = item.date
+    try:
+        parsed = TTrackItem.model_validate(parse_line(line, context))
+    except (ValueError, OverflowError):
+        return None
+    if (
+        compact_key(parsed) != compact_key(compacted)
+        or parsed.text != item.text
+        or parsed.time.time != total
+    ):
+        return None
+    return ("  " if in_date_context else "") + line
+
+
+def compact_lines(
+    lines: list[str],
+    items: t.Iterable[TTrackItem | TTrackWorkday],
+    comments: str = "keep",
+) -> list[str]:
+    if comments not in COMPACT_COMMENTS:
+        raise ValueError(f"unknown comment mode: {comments}")
+
+    # a "*" line takes its date from the entry above it, such an entry
+    # has to stay in place.
+    items = list(items)
+    anchors = {
+        previous.meta.line
+        for previous, item in itertools.pairwise(items)
+        if not lines[item.meta.line - 1].startswith("  ")
+        and strip_flags(lines[item.meta.line - 1]).startswith("*")
+    }
+
+    groups: dict[tuple, list[TTrackItem]] = {}
+    for item in items:
+        if not isinstance(item, TTrackItem):
+            continue
+        group = groups.setdefault(compact_key(item), [])
+        if group and item.meta.line in anchors:
+            continue
+        group.append(item)
+
+    merged: dict[int, str] = {}
+    dropped: set[int] = set()
+    for first, *duplicates in groups.values():
+        if not duplicates:
+            continue
+        total = sum((item.time.time for item in duplicates), first.time.time)
+        in_date_context = lines[first.meta.line - 1].startswith("  ")
+        if (rendered := render_compacted(first, total, in_date_context)) is None:
+            continue
+        merged[first.meta.line] = rendered
+        dropped.update(item.meta.line for item in duplicates)
+
+    result: list[str] = []
+    for line_no, line in enumerate(lines, 1):
+        if line_no in dropped:
+            continue
+        ending = line[len(line.rstrip("\r\n")) :]
+        if line_no in merged:
+            result.append(merged[line_no] + ending)
+            continue
+        if comment := RE_COMMENT.match(line.rstrip("\r\n")):
+            if comments == "drop":
+                continue
+            if comments == "normalize":
+                text = comment.group("text")
+                indent = comment.group("indent")
+                result.append(f"{indent}// {text}".rstrip() + ending)
+                continue
+        result.append(line)
+    return result
+
+
+def file_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def compact_file(
+    file: Path,
+    comments: str = "keep",
+    dry_run: bool = False,
+    backup_suffix: str = ".bak",
+) -> list[str]:
+    if is_compressed(file):
+        raise RuntimeError(f"{file} is an archive and cannot be compacted.")
+    content = file.read_bytes()
+    digest = file_digest(content)
+    lines = content.decode().splitlines(keepends=True)
+    items = parse_stream(lines, file)
+    compacted = compact_lines(lines, items, comments)
+    diff = list(
+        difflib.unified_diff(
+            lines, compacted, fromfile=str(file), tofile=f"{file} (compacted)"
+        )
+    )
+    if dry_run or not diff:
+        return diff
+
+    fd, tmp_name = tempfile.mkstemp(
+        dir=file.parent, prefix=f".{file.name}.", suffix=".tmp"
+    )
+    tmp_file = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "w") as fhandle:
+            fhandle.writelines(compacted)
+            fhandle.flush()
+            os.fsync(fhandle.fileno())
+        shutil.copymode(file, tmp_file)
+        if file_digest(file.read_bytes()) != digest:
+            raise RuntimeError(f"{file} changed during compaction, aborting.")
+        file.with_name(file.name + backup_suffix).write_bytes(content)
+        os.replace(tmp_file, file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+    return diff
+
+
+@app.command("compact")
+def compact_cmd(
+    ctx: typer.Context,
+    file: Annotated[Path | None, typer.Argument()] = None,
+    comments: Annotated[str | None, typer.Option("--comments")] = None,
+    dry_run: Annotated[bool, typer.Option("-n", "--dry-run", is_flag=True)] = False,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    timefile = file or ctx_obj.get_timefile()
+    try:
+        diff = compact_file(
+            timefile,
+            comments=comments or ctx_obj.get_compact_comments(),
+            dry_run=dry_run,
+        )
+    except (RuntimeError, ValueError) as error:
+        typer.echo(str(error), err=True)
+        raise typer.Exit(1) from error
+    if dry_run:
+        typer.echo("".join(diff), nl=False)
+        return
+    if not diff:
+        typer.echo(f"{timefile}: nothing to compact")
+        return
+    ctx_obj.apply_hook("post-compact", {})
+    typer.echo(f"{timefile}: compacted, backup in {timefile.name}.bak")
+
+
+RE_TIME_RANGE = re.compile(r"^(?P<start>\d{1,2}:\d{2})-(?P<end>\d{1,2}:\d{2})$")
+
+
+def lint_items(
+    items: t.Iterable[TTrackItem | TTrackWorkday], today: date
+) -> list[TTrackDiagnostic]:
+    result: list[TTrackDiagnostic] = []
+
+    def report(
+        item: TTrackItem | TTrackWorkday,
+        message: str,
+        severity: t.Literal["error", "warning"] = "warning",
+    ):
+        result.append(
+            TTrackDiagnostic(
+                file=item.meta.file,
+                line=item.meta.line,
+                severity=severity,
+                message=message,
+            )
+        )
+
+    open_workdays: dict[date, TTrackWorkday] = {}
+    ranges: dict[date, list[t.Tuple[time, time, TTrackItem]]] = defaultdict(list)
+    for item in items:
+        if item.date > today:
+            report(item, f"date {item.date.strftime(DATE_FORMAT)} is in the future")
+        if isinstance(item, TTrackWorkday):
+            start = open_workdays.pop(item.date, None)
+            if item.time.SYMBOL == ">":
+                if start is not None:
+                    report(start, "workday start '>' without end '<'", "error")
+                open_workdays[item.date] = item
+            elif start is None:
+                report(item, "workday end '<' without start '>'", "error")
+            continue
+        if item.time.time < timedelta(seconds=0):
+            report(item, f"negative duration {item.time.raw!r}", "error")
+        elif not item.time.time:
+            report(item, "zero duration")
+        if match := RE_TIME_RANGE.match(item.time.raw):
+            ranges[item.date].append(
+                (
+                    datetime.strptime(match.group("start"), TIME_FORMAT).time(),
+                    datetime.strptime(match.group("end"), TIME_FORMAT).time(),
+                    item,
+                )
+            )
+
+    for day, start in open_workdays.items():
+        # the workday of today is still running
+        if day != today:
+            report(start, "workday start '>' without end '<'", "error")
+
+    for day_ranges in ranges.values():
+        day_ranges.sort(key=lambda entry: entry[0])
+        # compare against the range reaching furthest so far, a short range
+        # in between must not hide a long one
+        _, latest_end, latest = day_ranges[0]
+        for start, end, item in day_ranges[1:]:
+            if start < latest_end:
+                report(item, f"time range overlaps line {latest.meta.line}")
+            if end > latest_end:
+                latest_end, latest = end, item
+
+    result.sort(key=lambda diagnostic: diagnostic.line)
+    return result
+
+
+def check_file(
+    file: Path, today: date, max_workers: int | None = None
+) -> list[TTrackDiagnostic]:
+    diagnostics: list[TTrackDiagnostic] = []
+    items = parse_file(file, diagnostics, max_workers)
+    diagnostics.extend(lint_items(items, today))
+    diagnostics.sort(key=lambda diagnostic: diagnostic.line)
+    return diagnostics
+
+
+def file_stamp(file: Path) -> list[int]:
+    stat = file.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def check_files(
+    files: list[Path],
+    today: date,
+    cache_file: Path | None = None,
+    max_workers: int | None = None,
+) -> dict[Path, list[TTrackDiagnostic]]:
+    cache: dict[str, dict] = {}
+    if cache_file is not None and cache_file.exists():
+        try:
+            cache = json.loads(cache_file.read_text())
+        except ValueError:
+            LOG.warning("ignoring broken check cache %s", cache_file)
+
+    result: dict[Path, list[TTrackDiagnostic]] = {}
+    stale: list[Path] = []
+    for file in files:
+        entry = cache.get(str(file))
+        stamp = [*file_stamp(file), today.toordinal()]
+        if entry is not None and entry["stamp"] == stamp:
+            result[file] = [
+                TTrackDiagnostic.model_validate(diagnostic)
+                for diagnostic in entry["diagnostics"]
+            ]
+        else:
+            stale.append(file)
+
+    if len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            checked = executor.map(
+                check_file, stale, itertools.repeat(today), itertools.repeat(1)
+            )
+            result.update(zip(stale, checked))
+    else:
+        result.update((file, check_file(file, today)) for file in stale)
+
+    if cache_file is not None and stale:
+        for file in stale:
+            cache[str(file)] = {
+                "stamp": [*file_stamp(file), today.toordinal()],
+                "diagnostics": [
+                    diagnostic.model_dump(mode="json") for diagnostic in result[file]
+                ],
+            }
+        cache_file.write_text(json.dumps(cache))
+
+    return {file: result[file] for file in files}
+
+
+@app.command("check")
+def check_cmd(
+    ctx: typer.Context,
+    files: Annotated[list[Path] | None, typer.Argument()] = None,
+    jobs: Annotated[int | None, typer.Option("-j", "--jobs")] = None,
+    use_cache: Annotated[bool, typer.Option("--cache/--no-cache")] = True,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    cache_file = ctx_obj.get_cachedir() / "check.json" if use_cache else None
+    checked = check_files(
+        files or ctx_obj.get_archive_files(),
+        date.today(),
+        cache_file=cache_file,
+        max_workers=jobs,
+    )
+    errors = warnings = 0
+    for diagnostics in checked.values():
+        for diagnostic in diagnostics:
+            if diagnostic.severity == "error":
+                errors += 1
+            else:
+                warnings += 1
+            CONSOLE.print(
+                diagnostic.format(),
+                style="red" if diagnostic.severity == "error" else "yellow",
+                highlight=False,
+                soft_wrap=True,
+            )
+    typer.echo(f"{len(checked)} files, {errors} errors, {warnings} warnings")
+    if errors:
+        raise typer.Exit(1)
+
+
+class TTrackVocabulary:
+    SIGILS: t.Final[dict[str, re.Pattern[str]]] = {
+        "+": RE_PROJECT,
+        "@": RE_CONTEXT,
+        "#": RE_TAG,
+    }
+
+    def __init__(self):
+        self._counts: dict[str, Counter[str]] = {
+            sigil: Counter() for sigil in self.SIGILS
+        }
+        self._ranked: dict[str, list[str]] = {}
+
+    def add_text(self, text: str):
+        for sigil, pattern in self.SIGILS.items():
+            self._counts[sigil].update(pattern.findall(text))
+        self._ranked.clear()
+
+    def add_file(self, file: Path):
+        with open_timefile(file) as fhandle:
+            self.add_text(fhandle.read())
+
+    def complete(self, sigil: str, prefix: str, limit: int = 50) -> list[str]:
+        if (ranked := self._ranked.get(sigil)) is None:
+            ranked = self._ranked[sigil] = [
+                name for name, _ in self._counts[sigil].most_common()
+            ]
+        return [name for name in ranked if name.startswith(prefix)][:limit]
+
+
+RE_COMPLETION_PREFIX = re.compile(r"(?:^|\s)(?P<sigil>[+@#])(?P<prefix>\w*)$")
+
+LSP_SEVERITIES: t.Final[dict[str, int]] = {"error": 1, "warning": 2}
+
+
+class TTrackBlock:
+    # parse result of a block, rebased in place when lines are inserted
+    # or removed above it.
+
+    def __init__(self, lines: tuple[str, ...], file: Path):
+        self.offset = 0
+        self.diagnostics: list[TTrackDiagnostic] = []
+        self.items = parse_stream(lines, file, self.diagnostics)
+
+    def rebase(self, offset: int):
+        if delta := offset - self.offset:
+            for item in self.items:
+                item.source += delta
+            for diagnostic in self.diagnostics:
+                diagnostic.line += delta
+            self.offset = offset
+
+
+class TTrackDocument:
+    # blocks start at every top level line that does not continue the
+    # previous date (date context lines and "*" lines), so each block
+    # parses on its own and unchanged blocks come from the cache.
+
+    BLOCK_CACHE_SIZE: t.ClassVar[int] = 4096
+
+    def __init__(self, uri: str, text: str):
+        self.uri = uri
+        self.file = Path(unquote(urlparse(uri).path))
+        self.lines = text.splitlines()
+        # keyed by the block lines and the how-many-th copy of these lines
+        # it is, so identical blocks never share their items
+        self._blocks: OrderedDict[tuple[tuple[str, ...], int], TTrackBlock] = (
+            OrderedDict()
+        )
+        self.parse()
+
+    def apply_change(self, change: dict):
+        if "range" not in change:
+            self.lines = change["text"].splitlines()
+            return
+        start, end = change["range"]["start"], change["range"]["end"]
+        # keep the lines list long enough for edits at the very end
+        while len(self.lines) <= end["line"]:
+            self.lines.append("")
+        head = self.lines[start["line"]][: start["character"]]
+        tail = self.lines[end["line"]][end["character"] :]
+        replacement = (head + change["text"] + tail).split("\n")
+        self.lines[start["line"] : end["line"] + 1] = replacement
+
+    def iter_blocks(self) -> t.Iterator[t.Tuple[int, tuple[str, ...]]]:
+        start = 0
+        for line_no, line in enumerate(self.lines):
+            if line_no == start or not is_chunk_boundary(line):
+                continue
+            yield start, tuple(self.lines[start:line_no])
+            start = line_no
+        if start < len(self.lines):
+            yield start, tuple(self.lines[start:])
+
+    def parse_block(self, lines: tuple[str, ...], copy: int) -> TTrackBlock:
+        key = (lines, copy)
+        if (block := self._blocks.get(key)) is not None:
+            self._blocks.move_to_end(key)
+            return block
+        block = self._blocks[key] = TTrackBlock(lines, self.file)
+        if len(self._blocks) > self.BLOCK_CACHE_SIZE:
+            self._blocks.popitem(last=False)
+        return block
+
+    def parse(self):
+        self.items: list[TTrackItem | TTrackWorkday] = []
+        self.diagnostics: list[TTrackDiagnostic] = []
+        copies: Counter[tuple[str, ...]] = Counter()
+        for offset, lines in self.iter_blocks():
+            block = self.parse_block(lines, copies[lines])
+            copies[lines] += 1
+            block.rebase(offset)
+            self.items.extend(block.items)
+            self.diagnostics.extend(block.diagnostics)
+
+    def daily_totals(self) -> dict[date, t.Tuple[int, timedelta]]:
+        totals: dict[date, t.Tuple[int, timedelta]] = {}
+        for item in self.items:
+            if not isinstance(item, TTrackItem):
+                continue
+            _, total = totals.get(item.date, (0, timedelta()))
+            totals[item.date] = (item.meta.line, total + item.time.time)
+        return totals
+
+
+class TTrackLanguageServer:
+    def __init__(self, vocabulary: TTrackVocabulary, today: date | None = None):
+        self.vocabulary = vocabulary
+        self.today = today or date.today()
+        self.documents: dict[str, TTrackDocument] = {}
+        self.running = True
+
+    def handle(self, message: dict) -> list[dict]:
+        method = message.get("method", "")
+        params = message.get("params") or {}
+        handler = getattr(self, "on_" + method.replace("/", "_").replace("$", ""), None)
+        if "id" not in message:
+            # notification, may answer with notifications of its own
+            try:
+                return handler(params) if handler is not None else []
+            except Exception:
+                LOG.exception("%s failed", method)
+                return []
+        if handler is None:
+            return [self.error(message["id"], -32601, f"unknown method {method}")]
+        try:
+            result = handler(params)
+        except Exception as error:
+            LOG.exception("%s failed", method)
+            return [self.error(message["id"], -32603, f"{method} failed: {error!r}")]
+        return [{"jsonrpc": "2.0", "id": message["id"], "result": result}]
+
+    def error(self, id_: int | str | None, code: int, message: str) -> dict:
+        return {
+            "jsonrpc": "2.0",
+            "id": id_,
+            "error": {"code": code, "message": message},
+        }
+
+    def on_initialize(self, params: dict) -> dict:
+        return {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": 2},
+                "completionProvider": {
+                    "triggerCharacters": list(TTrackVocabulary.SIGILS)
+                },
+                "inlayHintProvider": True,
+            },
+            "serverInfo": {"name": "timetrack.txt"},
+        }
+
+    def on_shutdown(self, params: dict) -> None:
+        return None
+
+    def on_exit(self, params: dict) -> list[dict]:
+        self.running = False
+        return []
+
+    def on_textDocument_didOpen(self, params: dict) -> list[dict]:
+        document = params["textDocument"]
+        self.documents[document["uri"]] = TTrackDocument(
+            document["uri"], document["text"]
+        )
+        return [self.publish_diagnostics(document["uri"])]
+
+    def on_textDocument_didChange(self, params: dict) -> list[dict]:
+        uri = params["textDocument"]["uri"]
+        document = self.documents[uri]
+        for change in params["contentChanges"]:
+            document.apply_change(change)
+        document.parse()
+        return [self.publish_diagnostics(uri)]
+
+    def on_textDocument_didClose(self, params: dict) -> list[dict]:
+        self.documents.pop(params["textDocument"]["uri"], None)
+        return []
+
+    def on_textDocument_completion(self, params: dict) -> list[dict]:
+        document = self.documents[params["textDocument"]["uri"]]
+        position = params["position"]
+        line = (
+            document.lines[position["line"]]
+            if position["line"] < len(document.lines)
+            else ""
+        )
+        match = RE_COMPLETION_PREFIX.search(line[: position["character"]])
+        if match is None:
+            return []
+        sigil, prefix = match.group("sigil"), match.group("prefix")
+        start = position["character"] - len(prefix) - 1
+        return [
+            {
+                "label": sigil + name,
+                "kind": 12,
+                "textEdit": {
+                    "range": {
+                        "start": {"line": position["line"], "character": start},
+                        "end": position,
+                    },
+                    "newText": sigil + name,
+                },
+            }
+            for name in self.vocabulary.complete(sigil, prefix)
+        ]
+
+    def on_textDocument_inlayHint(self, params: dict) -> list[dict]:
+        document = self.documents[params["textDocument"]["uri"]]
+        return [
+            {
+                "position": {
+                    "line": line - 1,
+                    "character": len(document.lines[line - 1]),
+                },
+                "label": f"= {format_timedelta(total)}",
+                "paddingLeft": True,
+            }
+            for line, total in document.daily_totals().values()
+        ]
+
+    def publish_diagnostics(self, uri: str) -> dict:
+        document = self.documents[uri]
+        diagnostics = [
+            *document.diagnostics,
+            *lint_items(document.items, self.today),
+        ]
+        return {
+            "jsonrpc": "2.0",
+            "method": "textDocument/publishDiagnostics",
+            "params": {
+                "uri": uri,
+                "diagnostics": [
+                    {
+                        "range": {
+                            "start": {"line": diagnostic.line - 1, "character": 0},
+                            "end": {
+                                "line": diagnostic.line - 1,
+                                "character": len(document.lines[diagnostic.line - 1]),
+                            },
+                        },
+                        "severity": LSP_SEVERITIES[diagnostic.severity],
+                        "source": "tt",
+                        "message": diagnostic.message,
+                    }
+                    for diagnostic in diagnostics
+                ],
+            },
+        }
+
+    def serve(self, reader: t.BinaryIO, writer: t.BinaryIO):
+        while self.running:
+            headers: dict[str, str] = {}
+            while line := reader.readline():
+                if not line.strip():
+                    break
+                name, _, value = line.decode("ascii").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if not headers:
+                return
+            body = reader.read(int(headers["content-length"]))
+            started = perf_counter()
+            try:
+                message = json.loads(body)
+                responses = self.handle(message)
+            except ValueError as error:
+                message, responses = {}, [self.error(None, -32700, str(error))]
+            for response in responses:
+                body = json.dumps(response).encode()
+                writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+            writer.flush()
+            LOG.debug(
+                "%s took %.2fms",
+                message.get("method"),
+                (perf_counter() - started) * 1000,
+            )
+
+
+@app.command("lsp")
+def lsp_cmd(ctx: typer.Context):
+    ctx_obj: TTrackContextObj = ctx.obj
+    vocabulary = TTrackVocabulary()
+    for file in ctx_obj.get_archive_files():
+        vocabulary.add_file(file)
+    server = TTrackLanguageServer(vocabulary)
+    server.serve(sys.stdin.buffer, sys.stdout.buffer)
+
+
+def archive_file(file: Path, compression: str = ".gz") -> Path:
+    module = COMPRESSIONS[compression]
+    archive = file.with_name(file.name + compression)
+    if archive.exists():
+        raise RuntimeError(f"{archive} already exists.")
+    content = file.read_bytes()
+    digest = file_digest(content)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=file.parent, prefix=f".{archive.name}.", suffix=".tmp"
+    )
+    os.close(fd)
+    tmp_file = Path(tmp_name)
+    try:
+        with module.open(tmp_file, "wb") as fhandle:
+            fhandle.write(content)
+        with module.open(tmp_file, "rb") as fhandle:
+            if fhandle.read() != content:
+                raise RuntimeError(f"verifying {archive} failed.")
+        shutil.copystat(file, tmp_file)
+        if file_digest(file.read_bytes()) != digest:
+            raise RuntimeError(f"{file} changed during archiving, aborting.")
+        os.replace(tmp_file, archive)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+    file.unlink()
+    return archive
+
+
+@app.command("archive")
+def archive_cmd(
+    ctx: typer.Context,
+    compression: Annotated[str, typer.Option("-f", "--format")] = "gz",
+    dry_run: Annotated[bool, typer.Option("-n", "--dry-run", is_flag=True)] = False,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    suffix = "." + compression.lstrip(".")
+    if suffix not in COMPRESSIONS:
+        raise typer.BadParameter(
+            f"use one of {', '.join(s[1:] for s in COMPRESSIONS)}.",
+            param_hint="--format",
+        )
+    # every file but the current one belongs to a closed period
+    timefile = ctx_obj.get_timefile()
+    closed = [
+        file
+        for file in ctx_obj.get_archive_files()
+        if file != timefile and not is_compressed(file)
+    ]
+    for file in closed:
+        if dry_run:
+            typer.echo(f"{file} -> {file.name}{suffix}")
+            continue
+        size = file.stat().st_size
+        archive = archive_file(file, suffix)
+        typer.echo(f"{file} -> {archive.name} ({size} -> {archive.stat().st_size})")
+    if closed and not dry_run:
+        ctx_obj.apply_hook("post-archive", {})
+
+
+class TTrackRollup:
+    # per day, project and billable flag partial sums of one user, cheap
+    # to merge and to cache as json.
+
+    def __init__(self):
+        self.time: Counter[tuple[int, str | None, bool]] = Counter()
+        self.worktime: Counter[int] = Counter()
+
+    def add_items(self, items: t.Iterable[TTrackItem | TTrackWorkday]):
+        open_workdays: dict[date, TTrackWorkday] = {}
+        for item in items:
+            if isinstance(item, TTrackItem):
+                key = (item.date.toordinal(), item.project, item.is_billable())
+                self.time[key] += int(item.time.time.total_seconds())
+            elif item.time.SYMBOL == ">":
+                open_workdays[item.date] = item
+            elif start := open_workdays.pop(item.date, None):
+                self.worktime[item.date.toordinal()] += int(
+                    start.diff(item).total_seconds()
+                )
+
+    def merge(self, other: "TTrackRollup") -> "TTrackRollup":
+        self.time.update(other.time)
+        self.worktime.update(other.worktime)
+        return self
+
+    def filter(self, daterange: t.Tuple[date, date] | None) -> "TTrackRollup":
+        if daterange is None:
+            return self
+        start, end = (day.toordinal() for day in daterange)
+        result = TTrackRollup()
+        result.time.update(
+            {key: value for key, value in self.time.items() if start <= key[0] <= end}
+        )
+        result.worktime.update(
+            {key: value for key, value in self.worktime.items() if start <= key <= end}
+        )
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "time": [[*key, value] for key, value in self.time.items()],
+            "worktime": [[key, value] for key, value in self.worktime.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TTrackRollup":
+        rollup = cls()
+        for day, project, billable, value in data["time"]:
+            rollup.time[(day, project, billable)] = value
+        rollup.worktime.update({day: value for day, value in data["worktime"]})
+        return rollup
+
+
+TEAM_FILE_PATTERN: t.Final[str] = "[0-9][0-9][0-9][0-9]-[0-9][0-9].txt"
+
+
+def find_user_files(user_dir: Path, pattern: str = TEAM_FILE_PATTERN) -> list[Path]:
+    # plain globbing instead of the users timetrack.cfg, its paths point
+    # into the users home and reading it would create missing timefiles
+    return prefer_plain(
+        file
+        for suffix in ("", *COMPRESSIONS)
+        for file in user_dir.rglob(pattern + suffix)
+        if not any(part.startswith(".") for part in file.relative_to(user_dir).parts)
+    )
+
+
+def user_fingerprint(user_dir: Path, files: list[Path]) -> str:
+    stamps = [[str(file.relative_to(user_dir)), *file_stamp(file)] for file in files]
+    return file_digest(json.dumps(stamps).encode())
+
+
+def rollup_user(
+    user_dir: Path, pattern: str = TEAM_FILE_PATTERN, max_workers: int | None = None
+) -> TTrackRollup:
+    rollup = TTrackRollup()
+    for file in find_user_files(user_dir, pattern):
+        diagnostics: list[TTrackDiagnostic] = []
+        rollup.add_items(parse_file(file, diagnostics, max_workers))
+        for diagnostic in diagnostics:
+            LOG.warning(diagnostic.format())
+    return rollup
+
+
+def rollup_team(
+    root: Path,
+    cachedir: Path | None = None,
+    max_workers: int | None = None,
+    pattern: str = TEAM_FILE_PATTERN,
+) -> dict[str, TTrackRollup]:
+    user_dirs = sorted(
+        path
+        for path in root.iterdir()
+        if path.is_dir() and not path.name.startswith(".")
+    )
+    result: dict[str, TTrackRollup] = {}
+    stale: dict[Path, t.Tuple[str, Path | None]] = {}
+    for user_dir in user_dirs:
+        fingerprint = user_fingerprint(user_dir, find_user_files(user_dir, pattern))
+        cache_file = None
+        if cachedir is not None:
+            key = file_digest(str(user_dir.resolve()).encode())
+            cache_file = cachedir / f"{key[:32]}.json"
+            if cache_file.exists():
+                try:
+                    cached = json.loads(cache_file.read_text())
+                    if cached["fingerprint"] == fingerprint:
+                        result[user_dir.name] = TTrackRollup.from_dict(cached["rollup"])
+                        continue
+                except (ValueError, KeyError, TypeError):
+                    LOG.warning("ignoring broken team cache %s", cache_file)
+        stale[user_dir] = (fingerprint, cache_file)
+
+    if len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rollups = zip(
+                stale,
+                executor.map(
+                    rollup_user, stale, itertools.repeat(pattern), itertools.repeat(1)
+                ),
+            )
+    else:
+        rollups = ((user_dir, rollup_user(user_dir, pattern)) for user_dir in stale)
+    for user_dir, rollup in rollups:
+        result[user_dir.name] = rollup
+        fingerprint, cache_file = stale[user_dir]
+        if cache_file is not None:
+            # an interrupted run must not leave a truncated cache behind
+            fd, tmp_name = tempfile.mkstemp(
+                dir=cache_file.parent, prefix=f".{cache_file.name}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w") as fhandle:
+                    json.dump(
+                        {"fingerprint": fingerprint, "rollup": rollup.to_dict()},
+                        fhandle,
+                    )
+                os.replace(tmp_name, cache_file)
+            finally:
+                Path(tmp_name).unlink(missing_ok=True)
+
+    return {user: result[user] for user in sorted(result)}
+
+
+@app.command("team")
+def team_cmd(
+    ctx: typer.Context,
+    root: Annotated[Path, typer.Argument(exists=True, file_okay=False)],
+    timespan: Annotated[str, typer.Argument()] = "all",
+    jobs: Annotated[int | None, typer.Option("-j", "--jobs")] = None,
+    use_cache: Annotated[bool, typer.Option("--cache/--no-cache")] = True,
+    pattern: Annotated[str, typer.Option("-p", "--pattern")] = TEAM_FILE_PATTERN,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    cachedir = None
+    if use_cache:
+        cachedir = ctx_obj.get_cachedir() / "team"
+        cachedir.mkdir(exist_ok=True)
+    daterange = timespan_to_filter_options(timespan).daterange
+    rollups = {
+        user: rollup.filter(daterange)
+        for user, rollup in rollup_team(root, cachedir, jobs, pattern).items()
+    }
+
+    users = Table(box=box.MINIMAL, padding=(0, 1))
+    users.add_column("user")
+    users.add_column("days", justify="right")
+    users.add_column("wtime", justify="right")
+    users.add_column("billable", justify="right")
+    users.add_column("time", justify="right")
+
+    def seconds(value: int) -> str:
+        return format_timedelta(timedelta(seconds=value))
+
+    team = TTrackRollup()
+    for user, rollup in rollups.items():
+        team.merge(rollup)
+        users.add_row(
+            user,
+            str(len({day for day, _, _ in rollup.time} | set(rollup.worktime))),
+            format_stat(rollup.worktime.total()),
+            format_stat(
+                sum(v for (_, _, billable), v in rollup.time.items() if billable)
+            ),
+            format_stat(rollup.time.total()),
+        )
+    users.add_row(
+        "",
+        "",
+        seconds(team.worktime.total()),
+        seconds(sum(v for (_, _, billable), v in team.time.items() if billable)),
+        seconds(team.time.total()),
+        style="blue bold",
+        end_section=True,
+    )
+
+    projects = Table(box=box.MINIMAL, padding=(0, 1))
+    projects.add_column("project")
+    projects.add_column("billable", justify="right")
+    projects.add_column("time", justify="right")
+    project_time: Counter[str | None] = Counter()
+    project_billable: Counter[str | None] = Counter()
+    for (_, project, billable), value in team.time.items():
+        project_time[project] += value
+        if billable:
+            project_billable[project] += value
+    for project, value in sorted(
+        project_time.items(), key=lambda entry: sort_group_key(entry[:1])
+    ):
+        projects.add_row(
+            project or "-", seconds(project_billable[project]), seconds(value)
+        )
+
+    CONSOLE.print(users)
+    CONSOLE.print(projects)
+
+
+class TTrackIndex:
+    # secondary indexes over the entries of a repository, used by the
+    # query planner to pick an access path and to estimate selectivity.
+
+    def __init__(self, items: t.Iterable[TTrackItem | TTrackWorkday]):
+        self.items = [item for item in items if isinstance(item, TTrackItem)]
+        self.by_date = sorted(self.items, key=lambda item: item.date)
+        self.ordinals = [item.date.toordinal() for item in self.by_date]
+        self.by_project: dict[str | None, list[TTrackItem]] = defaultdict(list)
+        self.counts: dict[str, Counter[t.Any]] = {
+            "context": Counter(),
+            "tag": Counter(),
+            "billable": Counter(),
+            "done": Counter(),
+        }
+        for item in self.items:
+            self.by_project[item.project].append(item)
+            self.counts["context"][item.context] += 1
+            self.counts["tag"].update(item.tags)
+            self.counts["billable"][item.is_billable()] += 1
+            self.counts["done"][item.is_done()] += 1
+
+    def date_range(self, start: int, end: int) -> list[TTrackItem]:
+        return self.by_date[
+            bisect_left(self.ordinals, start) : bisect_right(self.ordinals, end)
+        ]
+
+    def count_date_range(self, start: int, end: int) -> int:
+        return bisect_right(self.ordinals, end) - bisect_left(self.ordinals, start)
+
+
+class TTrackQueryError(ValueError):
+    pass
+
+
+RE_QUERY_TOKEN = re.compile(
+    r'\s*(?:"(?P<quoted>[^"]*)"|(?P<op><=|>=|!=|[=<>~,])|(?P<word>[^\s,=<>!~"]+))'
+)
+
+QUERY_FIELDS: t.Final[tuple[str, ...]] = (
+    "project",
+    "context",
+    "tag",
+    "text",
+    "date",
+    "time",
+)
+QUERY_FLAGS: t.Final[tuple[str, ...]] = ("billable", "done")
+
+DATE_MIN: t.Final[int] = date.min.toordinal()
+DATE_MAX: t.Final[int] = date.max.toordinal()
+
+
+def tokenize_query(query: str) -> list[str]:
+    tokens: list[str] = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = RE_QUERY_TOKEN.match(query, position)
+        if match is None or match.end() == position:
+            raise TTrackQueryError(f"cannot parse query at {query[position:]!r}")
+        tokens.append(next(value for value in match.groups() if value is not None))
+        position = match.end()
+    return tokens
+
+
+def parse_query_date(value: str) -> t.Tuple[int, int]:
+    # first and last day ordinal covered by a day, month or year
+    match value:
+        case "today":
+            day = date.today()
+            return day.toordinal(), day.toordinal()
+        case "yesterday":
+            day = date.today() - timedelta(days=1)
+            return day.toordinal(), day.toordinal()
+    for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            first = datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+        match fmt:
+            case "%Y-%m":
+                _, days = calendar.monthrange(first.year, first.month)
+                last = first.replace(day=days)
+            case "%Y":
+                last = date(first.year, 12, 31)
+            case _:
+                last = first
+        return first.toordinal(), last.toordinal()
+    raise TTrackQueryError(f"invalid date {value!r}")
+
+
+class TTrackQueryPredicate:
+    def __init__(self, field: str, op: str | None, value: str | None, negate: bool):
+        self.field = field
+        self.op = op
+        self.value = value
+        self.negate = negate
+        # negate as written, excludes whether matches are dropped after
+        # "date != x" was turned into a negated date range
+        self.excludes = negate
+        self.date_range: t.Tuple[int, int] | None = None
+        self._match = self._compile()
+
+    def _compile(self) -> t.Callable[[TTrackItem], bool]:
+        value = self.value or ""
+        match self.field, self.op:
+            case "billable", None:
+                return TTrackItem.is_billable
+            case "done", None:
+                return TTrackItem.is_done
+            case ("project" | "context") as field, "=":
+                return lambda item: getattr(item, field) == value
+            case ("project" | "context") as field, "!=":
+                return lambda item: getattr(item, field) != value
+            case ("project" | "context") as field, "~":
+                return lambda item: value in (getattr(item, field) or "")
+            case "tag", "=":
+                return lambda item: value in item.tags
+            case "tag", "!=":
+                return lambda item: value not in item.tags
+            case "text", "=" | "~":
+                lowered = value.lower()
+                return lambda item: lowered in item.text.lower()
+            case "date", "=" | "!=" | "<" | "<=" | ">" | ">=":
+                first, last = parse_query_date(value)
+                start, end = {
+                    "=": (first, last),
+                    "!=": (first, last),
+                    "<": (DATE_MIN, first - 1),
+                    "<=": (DATE_MIN, last),
+                    ">": (last + 1, DATE_MAX),
+                    ">=": (first, DATE_MAX),
+                }[self.op]
+                if self.op == "!=":
+                    self.excludes = not self.excludes
+                self.date_range = (start, end)
+                return lambda item: start <= item.date.toordinal() <= end
+            case "time", "=" | "!=" | "<" | "<=" | ">" | ">=":
+                seconds = pytimeparse.parse(value)
+                if seconds is None:
+                    raise TTrackQueryError(f"invalid duration {value!r}")
+                compare = {
+                    "=": operator.eq,
+                    "!=": operator.ne,
+                    "<": operator.lt,
+                    "<=": operator.le,
+                    ">": operator.gt,
+                    ">=": operator.ge,
+                }[self.op]
+                limit = timedelta(seconds=seconds)
+                return lambda item: compare(item.time.time, limit)
+        raise TTrackQueryError(f"unsupported predicate {self.describe()!r}")
+
+    def matches(self, item: TTrackItem) -> bool:
+        return self._match(item) != self.excludes
+
+    def selectivity(self, index: TTrackIndex) -> float:
+        total = len(index.items) or 1
+        if self.date_range is not None:
+            estimate = index.count_date_range(*self.date_range) / total
+        elif self.op in ("=", "!=") and self.field == "project":
+            estimate = len(index.by_project.get(self.value, ())) / total
+        elif self.op in ("=", "!=") and self.field in ("context", "tag"):
+            estimate = index.counts[self.field][self.value] / total
+        elif self.op is None:
+            estimate = index.counts[self.field][True] / total
+        else:
+            # no statistics for substring and duration predicates
+            estimate = 0.5 if self.field == "time" else 0.25
+        if self.op == "!=" and self.field != "date":
+            estimate = 1 - estimate
+        return 1 - estimate if self.excludes else estimate
+
+    def describe(self) -> str:
+        text = self.field if self.op is None else f"{self.field} {self.op} {self.value}"
+        return f"not {text}" if self.negate else text
+
+
+class TTrackQuery:
+    def __init__(
+        self,
+        predicates: list[TTrackQueryPredicate],
+        group: list[str],
+        aggregates: list[str],
+    ):
+        self.predicates = predicates
+        self.group = group
+        self.aggregates = aggregates
+
+    @classmethod
+    def parse(cls, query: str) -> "TTrackQuery":
+        tokens = tokenize_query(query)
+        predicates: list[TTrackQueryPredicate] = []
+        group: list[str] = []
+        aggregates: list[str] = []
+
+        def take() -> str:
+            if not tokens:
+                raise TTrackQueryError("unexpected end of query")
+            return tokens.pop(0)
+
+        while tokens and tokens[0] not in ("group", "sum", "count"):
+            negate = False
+            field = take().lower()
+            if field == "not":
+                negate, field = True, take().lower()
+            if field in QUERY_FLAGS:
+                predicates.append(TTrackQueryPredicate(field, None, None, negate))
+            elif field in QUERY_FIELDS:
+                op = take()
+                predicates.append(TTrackQueryPredicate(field, op, take(), negate))
+            else:
+                raise TTrackQueryError(f"unknown field {field!r}")
+            if tokens and tokens[0] == "and":
+                take()
+        if tokens and tokens[0] == "group":
+            take()
+            if take() != "by":
+                raise TTrackQueryError("expected 'group by'")
+            keys = [take()]
+            while tokens and tokens[0] == ",":
+                take()
+                keys.append(take())
+            try:
+                group = parse_group(",".join(keys))
+            except ValueError as error:
+                raise TTrackQueryError(str(error)) from error
+        while tokens:
+            match take():
+                case "sum":
+                    if take() != "time":
+                        raise TTrackQueryError("only 'sum time' is supported")
+                    aggregates.append("sum time")
+                case "count":
+                    aggregates.append("count")
+                case "and" | ",":
+                    pass
+                case token:
+                    raise TTrackQueryError(f"unexpected {token!r}")
+        if group and not aggregates:
+            aggregates.append("sum time")
+        return cls(predicates, group, aggregates)
+
+
+class TTrackQueryStep:
+    def __init__(self, description: str, estimate: float | None = None):
+        self.description = description
+        self.estimate = estimate
+        self.rows = 0
+
+
+class TTrackQueryPlan:
+    def __init__(self, query: TTrackQuery, index: TTrackIndex):
+        self.query = query
+        self.index = index
+        self.access, residual = self._choose_access_path()
+        # most selective predicates first, so most entries drop out early
+        self.filters = sorted(
+            ((p, p.selectivity(index)) for p in residual),
+            key=lambda entry: entry[1],
+        )
+        self.steps = [TTrackQueryStep(self.access[0], self.access[1])]
+        # each filter only sees what the steps before it let through
+        estimate = self.access[1]
+        for p, selectivity in self.filters:
+            estimate *= selectivity
+            self.steps.append(TTrackQueryStep(f"filter {p.describe()}", estimate))
+        if query.aggregates:
+            group = ",".join(query.group) or "all"
+            self.steps.append(
+                TTrackQueryStep(
+                    f"aggregate {' and '.join(query.aggregates)} by {group}"
+                )
+            )
+
+    def _choose_access_path(
+        self,
+    ) -> t.Tuple[t.Tuple[str, float, t.Callable[[], list[TTrackItem]]], list]:
+        index = self.index
+        predicates = list(self.query.predicates)
+        candidates = [
+            (
+                "full scan",
+                float(len(index.items)),
+                lambda: index.items,
+                [],
+            )
+        ]
+        date_predicates = [
+            p for p in predicates if p.date_range is not None and not p.excludes
+        ]
+        if date_predicates:
+            start = max(p.date_range[0] for p in date_predicates)
+            end = min(p.date_range[1] for p in date_predicates)
+            candidates.append(
+                (
+                    "date range {} .. {}".format(
+                        date.fromordinal(max(start, 1)),
+                        date.fromordinal(min(end, DATE_MAX)),
+                    )
+                    if start <= end
+                    else "date range (empty)",
+                    float(max(index.count_date_range(start, end), 0)),
+                    lambda: index.date_range(start, end),
+                    date_predicates,
+                )
+            )
+        for p in predicates:
+            if p.field == "project" and p.op == "=" and not p.excludes:
+                project_items = index.by_project.get(p.value, [])
+                candidates.append(
+                    (
+                        f"project index {p.value}",
+                        float(len(project_items)),
+                        lambda items=project_items: items,
+                        [p],
+                    )
+                )
+        description, estimate, fetch, consumed = min(
+            candidates, key=lambda candidate: candidate[1]
+        )
+        residual = [p for p in predicates if p not in consumed]
+        return (description, estimate, fetch), residual
+
+    def execute(self) -> t.Iterator[TTrackItem]:
+        _, _, fetch = self.access
+        steps = self.steps
+        for item in fetch():
+            steps[0].rows += 1
+            for step, (predicate, _) in zip(steps[1:], self.filters):
+                if not predicate.matches(item):
+                    break
+                step.rows += 1
+            else:
+                yield item
+
+    def aggregate(self) -> dict[tuple, dict[str, t.Any]]:
+        result: dict[tuple, dict[str, t.Any]] = {}
+        for item in self.execute():
+            for key in iter_group_keys(item, self.query.group):
+                if (row := result.get(key)) is None:
+                    row = result[key] = {"sum time": timedelta(), "count": 0}
+                row["sum time"] += item.time.time
+                row["count"] += 1
+        self.steps[-1].rows = len(result)
+        return {key: result[key] for key in sorted(result, key=sort_group_key)}
+
+    def explain(self) -> list[str]:
+        lines = []
+        for depth, step in enumerate(self.steps):
+            estimate = (
+                "" if step.estimate is None else f" (estimate {step.estimate:.0f})"
+            )
+            lines.append(
+                f"{'  ' * depth}-> {step.description}{estimate}: {step.rows} rows"
+            )
+        return lines
+
+
+@app.command("q")
+@app.command("query")
+def query_cmd(
+    ctx: typer.Context,
+    query: Annotated[list[str], typer.Argument()],
+    explain: Annotated[bool, typer.Option("--explain", is_flag=True)] = False,
+    archive: Annotated[bool, typer.Option("-a", "--archive", is_flag=True)] = False,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    try:
+        parsed = TTrackQuery.parse(" ".join(query))
+    except TTrackQueryError as error:
+        raise typer.BadParameter(str(error), param_hint="QUERY") from error
+    if archive:
+        index = TTrackIndex(
+            item
+            for file in ctx_obj.get_archive_files()
+            for item in parse_file(file, [])
+        )
+    else:
+        index = ctx_obj.repository.index
+    plan = TTrackQueryPlan(parsed, index)
+
+    table = Table(box=box.MINIMAL, padding=(0, 1))
+    if parsed.aggregates:
+        for key in parsed.group:
+            table.add_column(key)
+        for aggregate in parsed.aggregates:
+            table.add_column(aggregate, justify="right")
+        for key, row in plan.aggregate().items():
+            table.add_row(
+                *(format_group_value(k, v) for k, v in zip(parsed.group, key)),
+                *(
+                    format_timedelta(row[aggregate])
+                    if aggregate == "sum time"
+                    else str(row[aggregate])
+                    for aggregate in parsed.aggregates
+                ),
+            )
+    else:
+        for column in ("x", "$", "date", "time", "text", "project", "context"):
+            table.add_column(column)
+        for item in plan.execute():
+            table.add_row(
+                item.done or "-",
+                item.billable or "_",
+                item.date.strftime(DATE_FORMAT_DISPLAY),
+                item.time.format(),
+                item.text_clean,
+                item.project,
+                item.context,
+            )
+    CONSOLE.print(table)
+    if explain:
+        for line in plan.explain():
+            typer.echo(line)
+
+
+WEEKDAYS: t.Final[tuple[str, ...]] = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def month_index(day: date) -> int:
+    return day.year * 12 + day.month - 1
+
+
+def month_days(month: int) -> range:
+    year, month0 = divmod(month, 12)
+    first = date(year, month0 + 1, 1).toordinal()
+    return range(first, first + calendar.monthrange(year, month0 + 1)[1])
+
+
+def format_balance(td: timedelta) -> str:
+    sign = "-" if td < timedelta(0) else "+"
+    return sign + format_timedelta(abs(td))
+
+
+class TTrackLedger:
+    # running over/under time. worked seconds are kept per day and file,
+    # (worked - expected) is checkpointed as prefix sums over whole months.
+    # a changed file only drops the checkpoints from its first month on.
+
+    def __init__(self, time_per_day: timedelta, workdays: t.Iterable[int]):
+        self.time_per_day = int(time_per_day.total_seconds())
+        self.workdays = sorted(set(workdays))
+        self.files: dict[str, dict[str, t.Any]] = {}
+        self.worked: dict[int, Counter[int]] = defaultdict(Counter)
+        self.base: int | None = None
+        self.prefix: list[int] = []
+
+    def expected(self, ordinal: int) -> int:
+        if date.fromordinal(ordinal).weekday() in self.workdays:
+            return self.time_per_day
+        return 0
+
+    def day_delta(self, ordinal: int) -> int:
+        worked = self.worked.get(month_index(date.fromordinal(ordinal)))
+        return (worked[ordinal] if worked else 0) - self.expected(ordinal)
+
+    def month_delta(self, month: int) -> int:
+        worked = self.worked.get(month)
+        return (worked.total() if worked else 0) - sum(
+            self.expected(ordinal) for ordinal in month_days(month)
+        )
+
+    def invalidate(self, month: int):
+        if self.base is None or month < self.base:
+            self.base = month
+            self.prefix = []
+        else:
+            del self.prefix[month - self.base :]
+
+    def update(self, files: list[Path]) -> set[int]:
+        changed: set[int] = set()
+        seen = {str(file) for file in files}
+        for name in [name for name in self.files if name not in seen]:
+            changed |= self._remove_file(name)
+        for file in files:
+            stamp = file_stamp(file)
+            entry = self.files.get(str(file))
+            if entry is not None and entry["stamp"] == stamp:
+                continue
+            changed |= self._remove_file(str(file))
+            days: Counter[int] = Counter()
+            for item in parse_file(file, []):
+                if isinstance(item, TTrackItem):
+                    days[item.date.toordinal()] += int(item.time.time.total_seconds())
+            self.files[str(file)] = {"stamp": stamp, "days": days}
+            for ordinal, seconds in days.items():
+                month = month_index(date.fromordinal(ordinal))
+                self.worked[month][ordinal] += seconds
+                changed.add(month)
+        if changed:
+            self.invalidate(min(changed))
+        return changed
+
+    def _remove_file(self, name: str) -> set[int]:
+        entry = self.files.pop(name, None)
+        if entry is None:
+            return set()
+        months = set()
+        for ordinal, seconds in entry["days"].items():
+            month = month_index(date.fromordinal(ordinal))
+            self.worked[month][ordinal] -= seconds
+            months.add(month)
+        return months
+
+    def first_day(self) -> date | None:
+        days = [
+            day for worked in self.worked.values() for day, s in worked.items() if s
+        ]
+        return date.fromordinal(min(days)) if days else None
+
+    def months_delta(self, first: int, last: int) -> int:
+        # sum of month deltas of first..last using the checkpoints
+        if first > last:
+            return 0
+        if self.base is None or first < self.base:
+            before = min(last, (self.base or last + 1) - 1)
+            head = sum(self.month_delta(month) for month in range(first, before + 1))
+            return head + self.months_delta(before + 1, last)
+        while len(self.prefix) <= last - self.base:
+            month = self.base + len(self.prefix)
+            previous = self.prefix[-1] if self.prefix else 0
+            self.prefix.append(previous + self.month_delta(month))
+        total = self.prefix[last - self.base]
+        if first > self.base:
+            total -= self.prefix[first - self.base - 1]
+        return total
+
+    def balance(self, start: date, end: date) -> timedelta:
+        if start > end:
+            return timedelta(0)
+        first, last = month_index(start), month_index(end)
+        if first == last:
+            days = range(start.toordinal(), end.toordinal() + 1)
+            return timedelta(seconds=sum(self.day_delta(day) for day in days))
+        head = range(start.toordinal(), month_days(first).stop)
+        tail = range(month_days(last).start, end.toordinal() + 1)
+        seconds = (
+            sum(self.day_delta(day) for day in head)
+            + self.months_delta(first + 1, last - 1)
+            + sum(self.day_delta(day) for day in tail)
+        )
+        return timedelta(seconds=seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "time_per_day": self.time_per_day,
+            "workdays": self.workdays,
+            "files": {
+                name: {"stamp": entry["stamp"], "days": list(entry["days"].items())}
+                for name, entry in self.files.items()
+            },
+            "base": self.base,
+            "prefix": self.prefix,
+        }
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, time_per_day: timedelta, workdays: t.Iterable[int]
+    ) -> "TTrackLedger":
+        ledger = cls(time_per_day, workdays)
+        if [data["time_per_day"], data["workdays"]] != [
+            ledger.time_per_day,
+            ledger.workdays,
+        ]:
+            # checkpoints depend on the expected time, start over
+            return ledger
+        for name, entry in data["files"].items():
+            days = Counter({ordinal: seconds for ordinal, seconds in entry["days"]})
+            ledger.files[name] = {"stamp": entry["stamp"], "days": days}
+            for ordinal, seconds in days.items():
+                ledger.worked[month_index(date.fromordinal(ordinal))][ordinal] += (
+                    seconds
+                )
+        ledger.base = data["base"]
+        ledger.prefix = data["prefix"]
+        return ledger
+
+
+@app.command("balance")
+def balance_cmd(
+    ctx: typer.Context,
+    since: Annotated[
+        datetime | None, typer.Option("-s", "--since", formats=[DATE_FORMAT])
+    ] = None,
+    until: Annotated[
+        datetime | None, typer.Option("-u", "--until", formats=[DATE_FORMAT])
+    ] = None,
+    months: Annotated[bool, typer.Option("-m", "--months", is_flag=True)] = False,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    ledger = ctx_obj.get_ledger()
+    start = since.date() if since else ctx_obj.get_balance_start(ledger)
+    end = until.date() if until else date.today()
+    if start is None:
+        typer.echo("no entries yet.")
+        return
+    if months:
+        table = Table(box=box.MINIMAL, padding=(0, 1))
+        table.add_column("month")
+        table.add_column("delta", justify="right")
+        table.add_column("balance", justify="right")
+        for month in range(month_index(start), month_index(end) + 1):
+            days = month_days(month)
+            month_start = max(start, date.fromordinal(days.start))
+            month_end = min(end, date.fromordinal(days.stop - 1))
+            table.add_row(
+                format_group_value("month", month),
+                format_balance(ledger.balance(month_start, month_end)),
+                format_balance(ledger.balance(start, month_end)),
+            )
+        CONSOLE.print(table)
+    balance = ledger.balance(start, end)
+    CONSOLE.print(
+        f"balance {start.strftime(DATE_FORMAT)} .. {end.strftime(DATE_FORMAT)}:"
+        f" {format_balance(balance)}",
+        style="green" if balance >= timedelta(0) else "red",
+        highlight=False,
+    )
+
+
+class TTrackSketch:
+    # log-bucketed quantile sketch (as in DDSketch): every value is within
+    # relative_accuracy of its bucket, merging adds bucket counts and the
+    # number of buckets is capped by collapsing the lowest ones.
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Counter[int] = Counter()
+        self.zero_count = 0
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + self.buckets.total()
+
+    def add(self, value: float):
+        if value <= 0:
+            self.zero_count += 1
+            return
+        self.buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def merge(self, other: "TTrackSketch") -> "TTrackSketch":
+        self.buckets.update(other.buckets)
+        self.zero_count += other.zero_count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        return self
+
+    def _collapse(self):
+        keys = sorted(self.buckets)
+        excess = keys[: len(keys) - self.max_buckets + 1]
+        self.buckets[keys[len(excess)]] += sum(self.buckets.pop(k) for k in excess)
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self) -> dict:
+        return {"zero": self.zero_count, "buckets": list(self.buckets.items())}
+
+    def update_from_dict(self, data: dict):
+        self.zero_count += data["zero"]
+        self.buckets.update(dict(data["buckets"]))
+
+
+class TTrackStats:
+    # count, mean and variance (welford, merged after chan et al.) plus a
+    # quantile sketch, all of it bounded in size and mergeable.
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = TTrackSketch()
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.sketch.add(value)
+
+    def merge(self, other: "TTrackStats") -> "TTrackStats":
+        if other.count:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta**2 * self.count * other.count / count
+            self.count = count
+            self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "sketch": self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TTrackStats":
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = data["count"], data["mean"], data["m2"]
+        stats.sketch.update_from_dict(data["sketch"])
+        return stats
+
+
+StatsResult: t.TypeAlias = dict[tuple, dict[str, TTrackStats]]
+
+
+def stats_items(
+    items: t.Iterable[TTrackItem | TTrackWorkday], keys: list[str]
+) -> StatsResult:
+    result: StatsResult = defaultdict(
+        lambda: {"entry": TTrackStats(), "daily": TTrackStats()}
+    )
+    # daily sums only need the days of one file at a time
+    daily: Counter[tuple[tuple, int]] = Counter()
+    for item in items:
+        if not isinstance(item, TTrackItem):
+            continue
+        seconds = item.time.time.total_seconds()
+        for key in iter_group_keys(item, keys):
+            result[key]["entry"].add(seconds)
+            daily[(key, item.date.toordinal())] += seconds
+    for (key, _), seconds in daily.items():
+        result[key]["daily"].add(seconds)
+    return dict(result)
+
+
+def merge_stats(target: StatsResult, other: StatsResult) -> StatsResult:
+    for key, stats in other.items():
+        if key not in target:
+            target[key] = {"entry": TTrackStats(), "daily": TTrackStats()}
+        for name, value in stats.items():
+            target[key][name].merge(value)
+    return target
+
+
+def stats_file(
+    file: Path, keys: list[str], daterange: t.Tuple[date, date] | None
+) -> StatsResult:
+    items = parse_file(file, [])
+    if daterange is not None:
+        start, end = daterange
+        items = [item for item in items if start <= item.date <= end]
+    return stats_items(items, keys)
+
+
+def stats_files(
+    files: list[Path],
+    keys: list[str],
+    daterange: t.Tuple[date, date] | None = None,
+    cache_file: Path | None = None,
+) -> StatsResult:
+    cache: dict[str, dict] = {}
+    if cache_file is not None and cache_file.exists():
+        try:
+            cache = json.loads(cache_file.read_text())
+        except ValueError:
+            LOG.warning("ignoring broken stats cache %s", cache_file)
+    query = [keys, [day.toordinal() for day in daterange] if daterange else None]
+
+    result: StatsResult = {}
+    for file in files:
+        stamp = [*file_stamp(file), query]
+        entry = cache.get(str(file))
+        if entry is not None and entry["stamp"] == stamp:
+            partial = {
+                tuple(key): {
+                    name: TTrackStats.from_dict(value) for name, value in stats.items()
+                }
+                for key, stats in entry["stats"]
+            }
+        else:
+            partial = stats_file(file, keys, daterange)
+            cache[str(file)] = {
+                "stamp": stamp,
+                "stats": [
+                    [key, {name: value.to_dict() for name, value in stats.items()}]
+                    for key, stats in partial.items()
+                ],
+            }
+        merge_stats(result, partial)
+
+    if cache_file is not None:
+        cache_file.write_text(json.dumps(cache))
+    return {key: result[key] for key in sorted(result, key=sort_group_key)}
+
+
+def format_stat(value: float | None) -> str:
+    # sketch quantiles are estimates, 1790.4 has to show as 30m, not 29m
+    if value is None:
+        return ""
+    return format_timedelta(timedelta(minutes=round(value / 60)))
+
+
+@app.command("stats")
+def stats_cmd(
+    ctx: typer.Context,
+    timespan: Annotated[str, typer.Argument()] = "all",
+    group: Annotated[str, typer.Option("-g", "--group")] = "project",
+    use_cache: Annotated[bool, typer.Option("--cache/--no-cache")] = True,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    try:
+        group_keys = parse_group(group)
+    except ValueError as error:
+        raise typer.BadParameter(str(error), param_hint="--group") from error
+    daterange = timespan_to_filter_options(timespan).daterange
+    cache_file = ctx_obj.get_cachedir() / "stats.json" if use_cache else None
+    result = stats_files(ctx_obj.get_archive_files(), group_keys, daterange, cache_file)
+
+    table = Table(box=box.MINIMAL, padding=(0, 1))
+    table.add_column(",".join(group_keys))
+    for column in ("n", "mean", "sd", "p50", "p90"):
+        table.add_column(column, justify="right")
+    for column in ("days", "mean/day", "p50/day", "p90/day"):
+        table.add_column(column, justify="right")
+    for key, stats in result.items():
+        entry, daily = stats["entry"], stats["daily"]
+        table.add_row(
+            format_group_key(group_keys, key),
+            str(entry.count),
+            format_stat(entry.mean),
+            format_stat(math.sqrt(entry.variance)),
+            format_stat(entry.sketch.quantile(0.5)),
+            format_stat(entry.sketch.quantile(0.9)),
+            str(daily.count),
+            format_stat(daily.mean),
+            format_stat(daily.sketch.quantile(0.5)),
+            format_stat(daily.sketch.quantile(0.9)),
+        )
+    CONSOLE.print(table)
+
+
+IMPORT_FIELDS: t.Final[dict[str, tuple[str, ...]]] = {
+    "date": ("date", "start date", "start", "startdate"),
+    "end": ("end", "stop", "end date"),
+    "duration": ("duration", "duration (h)", "dur"),
+    "text": ("description", "text", "title"),
+    "project": ("project", "project_name"),
+    "context": ("client", "client_name", "context"),
+    "tags": ("tags",),
+    "billable": ("billable",),
+}
+IMPORT_FORMATS: t.Final[dict[str, str]] = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+}
+IMPORT_TRUE: t.Final[set[str]] = {"1", "true", "yes", "y", "x", "$"}
+RE_CLOCK_DURATION = re.compile(
+    r"^(?P<hours>\d+):(?P<minutes>\d{2})(?::(?P<seconds>\d{2}))?$"
+)
+
+
+class TTrackImportRules(BaseModel):
+    projects: dict[str, str] = Field(default_factory=dict)
+    contexts: dict[str, str] = Field(default_factory=dict)
+    billable_projects: set[str] = Field(default_factory=set)
+    date_format: str | None = None
+
+    def map_name(self, mapping: dict[str, str], name: str) -> str | None:
+        name = name.strip()
+        if name.lower() in mapping:
+            name = mapping[name.lower()]
+        return re.sub(r"\W+", "_", name).strip("_") or None
+
+    def parse_date(self, value: t.Any) -> date:
+        value = str(value).strip()
+        try:
+            return datetime.fromisoformat(value).date()
+        except ValueError:
+            pass
+        try:
+            if self.date_format is not None:
+                return datetime.strptime(value, self.date_format).date()
+        except ValueError:
+            pass
+        raise ValueError(f"invalid date: {value!r}")
+
+
+def get_import_field(record: dict[str, t.Any], field: str) -> t.Any:
+    for name in IMPORT_FIELDS[field]:
+        if (value := record.get(name)) not in (None, ""):
+            return value
+    return None
+
+
+def parse_import_duration(record: dict[str, t.Any]) -> timedelta:
+    # bare numbers are seconds, clock values hours:minutes[:seconds]
+    value = get_import_field(record, "duration")
+    if value is None:
+        start, end = get_import_field(record, "date"), get_import_field(record, "end")
+        if start is None or end is None:
+            raise ValueError("record has neither a duration nor start and end")
+        return datetime.fromisoformat(str(end)) - datetime.fromisoformat(str(start))
+    if isinstance(value, (int, float)):
+        return timedelta(seconds=value)
+    value = value.strip()
+    if match := RE_CLOCK_DURATION.match(value):
+        return timedelta(
+            hours=int(match["hours"]),
+            minutes=int(match["minutes"]),
+            seconds=int(match["seconds"] or 0),
+        )
+    try:
+        return timedelta(seconds=float(value))
+    except ValueError:
+        pass
+    if (seconds := pytimeparse.parse(value)) is None:
+        raise ValueError(f"invalid duration: {value!r}")
+    return timedelta(seconds=seconds)
+
+
+def record_to_item(
+    record: dict[str, t.Any], rules: TTrackImportRules, source: int
+) -> TTrackItem:
+    duration = parse_import_duration(record)
+    if duration < timedelta(0):
+        raise ValueError(f"negative duration: {format_timedelta(-duration)}")
+    # timefiles hold whole minutes, round instead of cutting off seconds.
+    # "0m" is no duration to the parser, so empty records are refused.
+    minutes = int(duration / timedelta(minutes=1) + 0.5)
+    if minutes == 0:
+        raise ValueError(f"duration {duration} rounds to zero minutes")
+    duration = timedelta(minutes=minutes)
+    date_ = get_import_field(record, "date")
+    if date_ is None:
+        raise ValueError("record has no date")
+    parts = [" ".join(str(get_import_field(record, "text") or "").split())]
+    project = get_import_field(record, "project")
+    if project and (project := rules.map_name(rules.projects, str(project))):
+        parts.append(f"+{project}")
+    context = get_import_field(record, "context")
+    if context and (context := rules.map_name(rules.contexts, str(context))):
+        parts.append(f"@{context}")
+    tags = get_import_field(record, "tags") or []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    parts.extend(f"#{tag}" for tag in map(partial(rules.map_name, {}), tags) if tag)
+    billable = get_import_field(record, "billable")
+    if isinstance(billable, str):
+        billable = billable.strip().lower() in IMPORT_TRUE
+    time_ = format_timedelta(duration)
+    return TTrackItem(
+        source=source,
+        done=None,
+        billable="$" if billable or project in rules.billable_projects else None,
+        date=rules.parse_date(date_),
+        time=TTrackTimeItem(raw=time_, time=duration),
+        text=" ".join(part for part in parts if part),
+    )
+
+
+def read_import_records(
+    file: Path,
+    fhandle: t.TextIO,
+    diagnostics: list[TTrackDiagnostic],
+    format_: str | None = None,
+) -> t.Iterator[t.Tuple[int, dict[str, t.Any]]]:
+    format_ = format_ or IMPORT_FORMATS.get(file.suffix.lower())
+    if format_ == "csv":
+        reader = csv.DictReader(fhandle)
+        try:
+            for row in reader:
+                yield (
+                    reader.line_num,
+                    {key.strip().lower(): value for key, value in row.items() if key},
+                )
+        except csv.Error as error:
+            # the reader cannot resync after a broken row
+            diagnostics.append(
+                TTrackDiagnostic(file=file, line=reader.line_num, message=str(error))
+            )
+    elif format_ == "jsonl":
+        for line_no, line in enumerate(fhandle, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                record = error
+            if not isinstance(record, dict):
+                diagnostics.append(
+                    TTrackDiagnostic(
+                        file=file, line=line_no, message="not a json object"
+                    )
+                )
+                continue
+            yield line_no, {key.lower(): value for key, value in record.items()}
+    else:
+        raise ValueError(f"unknown import format for {file}")
+
+
+def import_lines(
+    file: Path,
+    rules: TTrackImportRules,
+    diagnostics: list[TTrackDiagnostic],
+    format_: str | None = None,
+) -> t.Iterator[t.Tuple[date, str]]:
+    with file.open(newline="") as fhandle:
+        for line_no, record in read_import_records(file, fhandle, diagnostics, format_):
+            try:
+                item = record_to_item(record, rules, pack_source(file, line_no))
+            except (ValueError, TypeError, OverflowError) as error:
+                diagnostics.append(
+                    TTrackDiagnostic(
+                        file=file, line=line_no, message=format_parse_error(error)
+                    )
+                )
+                continue
+            yield item.date, item.to_line(sep=" ", with_date=False)
+
+
+def sort_import_lines(
+    lines: t.Iterable[t.Tuple[date, str]], tmp_dir: Path, chunk_size: int
+) -> t.Iterator[t.Tuple[str, str]]:
+    # external merge sort: sorted runs are spilled to disk and merged
+    # lazily, so only one chunk is held in memory. both steps are stable
+    # and keep the input order of entries on the same day.
+    runs: list[Path] = []
+    for chunk in itertools.batched(lines, chunk_size):
+        run = tmp_dir / f"run-{len(runs)}.txt"
+        with run.open("w") as fhandle:
+            for date_, line in sorted(chunk, key=operator.itemgetter(0)):
+                fhandle.write(f"{date_.strftime(DATE_FORMAT)}\t{line}\n")
+        runs.append(run)
+    with ExitStack() as stack:
+        handles = [stack.enter_context(run.open()) for run in runs]
+        for row in heapq.merge(*handles, key=lambda row: row.partition("\t")[0]):
+            iso, _, line = row.rstrip("\n").partition("\t")
+            yield iso, line
+
+
+def import_file(
+    file: Path,
+    rules: TTrackImportRules,
+    target_for: t.Callable[[date], Path],
+    diagnostics: list[TTrackDiagnostic],
+    format_: str | None = None,
+    chunk_size: int = 10_000,
+    dry_run: bool = False,
+) -> Counter[Path]:
+    # the target of every day is known once the runs are written, so
+    # archived months are refused before anything is appended.
+    targets: dict[date, Path] = {}
+
+    def collect(lines: t.Iterable[t.Tuple[date, str]]):
+        for date_, line in lines:
+            if date_ not in targets:
+                targets[date_] = target_for(date_)
+            yield date_, line
+
+    written: Counter[Path] = Counter()
+    with tempfile.TemporaryDirectory(prefix="tt-import-") as tmp_dir:
+        rows = sort_import_lines(
+            collect(import_lines(file, rules, diagnostics, format_)),
+            Path(tmp_dir),
+            chunk_size,
+        )
+        first = next(rows, None)
+        for target in set(targets.values()):
+            for suffix in COMPRESSIONS:
+                if (archive := target.with_name(target.name + suffix)).exists():
+                    raise RuntimeError(f"{target} is archived as {archive}.")
+        if first is None:
+            return written
+        target, fhandle, current = None, None, None
+        with ExitStack() as stack:
+            for iso, line in itertools.chain([first], rows):
+                day = date.fromisoformat(iso)
+                if targets[day] != target:
+                    target, current = targets[day], None
+                    if not dry_run:
+                        stack.close()
+                        fhandle = stack.enter_context(open_import_target(target))
+                if fhandle is not None:
+                    if iso != current:
+                        fhandle.write(f"{iso}\n")
+                    fhandle.write(f"  {line}\n")
+                current = iso
+                written[target] += 1
+    return written
+
+
+@contextmanager
+def open_import_target(target: Path) -> t.Iterator[t.TextIO]:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with target.open("a+b") as fhandle:
+        if fhandle.tell() > 0:
+            fhandle.seek(-1, os.SEEK_END)
+            if fhandle.read(1) != b"\n":
+                fhandle.write(b"\n")
+    with target.open("a") as fhandle:
+        yield fhandle
+
+
+@app.command("import")
+def import_cmd(
+    ctx: typer.Context,
+    file: Annotated[Path, typer.Argument(exists=True, dir_okay=False)],
+    format_: Annotated[str | None, typer.Option("-f", "--format")] = None,
+    chunk_size: Annotated[int, typer.Option("--chunk-size", min=1)] = 10_000,
+    dry_run: Annotated[bool, typer.Option("-n", "--dry-run", is_flag=True)] = False,
+):
+    ctx_obj: TTrackContextObj = ctx.obj
+    if format_ is not None and format_ not in IMPORT_FORMATS.values():
+        raise typer.BadParameter(
+            f"use one of {', '.join(sorted(set(IMPORT_FORMATS.values())))}.",
+            param_hint="--format",
+        )
+    if format_ is None and file.suffix.lower() not in IMPORT_FORMATS:
+        raise typer.BadParameter(
+            f"cannot guess the format of {file.name}.", param_hint="--format"
+        )
+    diagnostics: list[TTrackDiagnostic] = []
+    written = import_file(
+        file,
+        ctx_obj.get_import_rules(),
+        ctx_obj.get_timefile_for,
+        diagnostics,
+        format_=format_,
+        chunk_size=chunk_size,
+        dry_run=dry_run,
+    )
+    for diagnostic in diagnostics:
+        CONSOLE.print(diagnostic.format(), style="red", highlight=False, soft_wrap=True)
+    for target, entries in sorted(written.items()):
+        typer.echo(f"{target}: {entries} entries")
+    typer.echo(
+        f"{written.total()} entries imported, {len(diagnostics)} records skipped"
+        + (" (dry run)" if dry_run else "")
+    )
+    if written and not dry_run:
+        ctx_obj.apply_hook("post-import", {})
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,111 @@
+"""
+benchmarks for timetrack.py
+
+    python timetrack_bench.py [benchmark ...]
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+from time import perf_counter
+
+import timetrack
+
+BENCH_FILE = Path("bench.txt")
+
+
+def generate_lines(count: int) -> list[str]:
+    # a month-structured mix of plain entries, ranges and date contexts
+    lines: list[str] = []
+    day = date(2020, 1, 1)
+    while len(lines) < count:
+        iso = day.strftime(timetrack.DATE_FORMAT)
+        lines.extend(
+            [
+                f"{iso}\n",
+                "  >08:00\n",
+                "  x $ 15m standup +bt @meeting #daily\n",
+                f"  $ 1h{len(lines) % 60}m feature work +bt @dev\n",
+                "  <12:00\n",
+                f"{iso} 15m hello\n",
+                f"x {iso} 13:00-14:30 review +tt @dev #review\n",
+                f"$ {iso} ... support call +bt @telefon\n",
+                "// lunch\n",
+            ]
+        )
+        day += timedelta(days=1)
+    return lines[:count]
+
+
+def bench_memory(count: int = 100_000):
+    lines = generate_lines(count)
+    tracemalloc.start()
+    items = timetrack.parse_stream(lines, BENCH_FILE)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"memory: {len(items)} items, {current / 1024 / 1024:.1f} MiB,"
+        f" {current / len(items):.0f} bytes/item"
+    )
+
+
+def best_of(func, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def bench_compression(count: int = 50_000):
+    lines = generate_lines(count)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plain = Path(tmp_dir) / "2020-01.txt"
+        plain.write_text("".join(lines))
+        files = [plain]
+        for suffix in timetrack.COMPRESSIONS:
+            copy = plain.with_name(f"copy-{plain.name}")
+            copy.write_bytes(plain.read_bytes())
+            files.append(timetrack.archive_file(copy, suffix))
+        for file in files:
+            seconds = best_of(lambda file=file: timetrack.parse_file(file))
+            print(
+                f"compression: {file.name:<20} {file.stat().st_size / 1024:8.0f} KiB"
+                f" {seconds * 1000:8.1f} ms"
+            )
+
+
+def bench_parallel(count: int = 200_000):
+    lines = generate_lines(count)
+    executor = "threads" if not sys._is_gil_enabled() else "processes"
+    baseline = best_of(lambda: timetrack.parse_stream(lines, BENCH_FILE))
+    print(f"parallel: sequential {baseline * 1000:8.1f} ms")
+    cpus = os.process_cpu_count() or 1
+    workers = 2
+    while workers <= max(cpus, 2):
+        seconds = best_of(
+            lambda workers=workers: timetrack.parse_lines_parallel(
+                lines, BENCH_FILE, max_workers=workers
+            )
+        )
+        print(
+            f"parallel: {workers:>2} {executor:<9} {seconds * 1000:8.1f} ms"
+            f" {baseline / seconds:5.2f}x ({cpus} cpus)"
+        )
+        workers *= 2
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "compression": bench_compression,
+    "parallel": bench_parallel,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
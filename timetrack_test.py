@@ -6,8 +6,49 @@ from timetrack import (
     RE_PROJECT,
     RE_CONTEXT,
     parser_date,
+    compact_file,
+    compact_lines,
+    parse_stream,
+    check_files,
+    lint_items,
+    TTrackParseError,
+    aggregate_time,
+    format_group_key,
+    group_items,
+    parse_group,
+    TTrackLanguageServer,
+    TTrackVocabulary,
+    archive_file,
+    parse_file,
+    rollup_team,
+    TTrackIndex,
+    TTrackQuery,
+    TTrackQueryError,
+    TTrackQueryPlan,
+    TTrackLedger,
+    TTrackRepository,
+    SummaryTable,
+    TTrackSketch,
+    TTrackStats,
+    stats_files,
+    format_stat,
+    parse_item_cached,
+    TTrackImportRules,
+    import_file,
+    parse_lines_parallel,
+    check_file,
 )
 from pathlib import Path
+import gzip
+import io
+import lzma
+import os
+import sys
+import timetrack
+import json
+import random
+import statistics
+import shutil
 import pytest
 from datetime import date, timedelta
 
@@ -119,3 +160,811 @@ def test_parser_date():
 def test_parser_date_fail():
     key, date, str_ = parser_date("not-a-date")
     print(key, date, str_)
+
+
+COMPACT_SOURCE = """\
+// standup
+2024-07-08 15m hello
+2024-07-08 15m hello
+2024-07-08 15m hello @telefon +bt
+2024-07-09
+  >08:00
+  $ 10m review +bt
+  $ 20m review +bt
+  <12:00
+"""
+
+
+@pytest.mark.parametrize(
+    "comments,expected",
+    (
+        (
+            "keep",
+            [
+                "// standup\n",
+                "2024-07-08 30m hello\n",
+                "2024-07-08 15m hello @telefon +bt\n",
+                "2024-07-09\n",
+                "  >08:00\n",
+                "  $ 30m review +bt\n",
+                "  <12:00\n",
+            ],
+        ),
+        (
+            "drop",
+            [
+                "2024-07-08 30m hello\n",
+                "2024-07-08 15m hello @telefon +bt\n",
+                "2024-07-09\n",
+                "  >08:00\n",
+                "  $ 30m review +bt\n",
+                "  <12:00\n",
+            ],
+        ),
+    ),
+)
+def test_compact_lines(comments: str, expected: list[str]):
+    lines = COMPACT_SOURCE.splitlines(keepends=True)
+    items = parse_stream(lines, Path("compact.txt"))
+    assert compact_lines(lines, items, comments) == expected
+
+
+def test_compact_file(tmp_path: Path):
+    timefile = tmp_path / "2024-07.txt"
+    timefile.write_text(COMPACT_SOURCE)
+
+    diff = compact_file(timefile, dry_run=True)
+    assert diff
+    assert timefile.read_text() == COMPACT_SOURCE
+
+    compact_file(timefile)
+    assert (tmp_path / "2024-07.txt.bak").read_text() == COMPACT_SOURCE
+    assert "2024-07-08 30m hello\n" in timefile.read_text()
+    assert compact_file(timefile) == []
+
+
+def test_compact_file_keeps_star_dates(tmp_path: Path):
+    timefile = tmp_path / "2024-07.txt"
+    timefile.write_text(
+        "2024-07-08 15m hello +a\n"
+        "2024-07-09 10m other +b\n"
+        "2024-07-08 15m hello +a\n"
+        "* 5m foo +c\n"
+        "2024-07-09 10m other +b\n"
+    )
+    before = parse_stream(timefile.read_text().splitlines(), timefile)
+
+    compact_file(timefile)
+    after = parse_stream(timefile.read_text().splitlines(), timefile)
+
+    assert {(i.text, i.date) for i in after} == {(i.text, i.date) for i in before}
+    assert [i.date for i in after if i.text == "foo +c"] == [date(2024, 7, 8)]
+    assert "2024-07-09 20m other +b\n" in timefile.read_text()
+
+
+def test_compact_lines_keeps_unrenderable_totals():
+    source = [
+        "2024-07-08 45s a\n",
+        "2024-07-08 45s a\n",
+        "2024-07-09 23:00-01:00 oncall\n",
+        "2024-07-09 23:00-01:00 oncall\n",
+        "2024-07-10 15m b\n",
+        "2024-07-10 15m b\n",
+    ]
+    items = parse_stream(source, Path("compact.txt"))
+    assert compact_lines(source, items) == [*source[:4], "2024-07-10 30m b\n"]
+
+
+def test_compact_file_refuses_concurrent_change(tmp_path: Path, monkeypatch):
+    timefile = tmp_path / "2024-07.txt"
+    timefile.write_text(COMPACT_SOURCE)
+
+    copymode = shutil.copymode
+
+    def copymode_and_append(src, dst):
+        copymode(src, dst)
+        with timefile.open("a") as fhandle:
+            fhandle.write("2024-07-10 1h late\n")
+
+    monkeypatch.setattr(shutil, "copymode", copymode_and_append)
+    with pytest.raises(RuntimeError):
+        compact_file(timefile)
+    assert timefile.read_text().startswith(COMPACT_SOURCE)
+    assert not (tmp_path / "2024-07.txt.bak").exists()
+    assert [p.name for p in tmp_path.iterdir()] == ["2024-07.txt"]
+
+
+BROKEN_SOURCE = """\
+2024-07-08 15m hello
+  >08:00
+2024-07-08 25:00-26:00 broken range
+2024-07-09
+  >8:x
+  <12:00
+no date here
+2024-07-10 1h ok
+"""
+
+
+def test_parse_stream_recovers():
+    diagnostics = []
+    items = parse_stream(BROKEN_SOURCE.splitlines(), Path("broken.txt"), diagnostics)
+    assert [item.meta.line for item in items] == [1, 6, 8]
+    assert [diagnostic.line for diagnostic in diagnostics] == [2, 3, 5, 7]
+
+
+def test_parse_stream_raises_without_diagnostics():
+    with pytest.raises(TTrackParseError) as error:
+        parse_stream(BROKEN_SOURCE.splitlines(), Path("broken.txt"))
+    assert error.value.diagnostic.line == 2
+
+
+def test_lint_items():
+    source = """\
+2024-07-08 10:00-11:00 first
+2024-07-08 10:30-11:30 overlapping
+2024-07-09
+  >08:00
+  >09:00
+  <12:00
+  <13:00
+2024-07-10 no time
+2099-01-01 1h future
+"""
+    items = parse_stream(source.splitlines(), Path("lint.txt"))
+    diagnostics = lint_items(items, date(2024, 7, 31))
+    assert [(d.line, d.severity) for d in diagnostics] == [
+        (2, "warning"),
+        (4, "error"),
+        (7, "error"),
+        (8, "warning"),
+        (9, "warning"),
+    ]
+
+
+def test_lint_items_nested_ranges():
+    source = """\
+2024-07-08 09:00-12:00 long
+2024-07-08 10:00-10:30 first
+2024-07-08 11:00-11:30 second
+2024-07-08 12:00-13:00 after
+"""
+    items = parse_stream(source.splitlines(), Path("lint.txt"))
+    diagnostics = lint_items(items, date(2024, 7, 31))
+    assert [(d.line, d.message) for d in diagnostics] == [
+        (2, "time range overlaps line 1"),
+        (3, "time range overlaps line 1"),
+    ]
+
+
+def test_check_files_cache(tmp_path: Path):
+    timefile = tmp_path / "2024-07.txt"
+    timefile.write_text(BROKEN_SOURCE)
+    cache_file = tmp_path / "check.json"
+    today = date(2024, 7, 31)
+
+    checked = check_files([timefile], today, cache_file=cache_file)
+    assert len(checked[timefile]) == 5
+    assert cache_file.exists()
+
+    # a cache hit returns the stored diagnostics without parsing again
+    cache = cache_file.read_text()
+    cache_file.write_text(cache.replace("invalid time range", "from cache"))
+    checked = check_files([timefile], today, cache_file=cache_file)
+    assert "from cache" in checked[timefile][1].message
+
+
+def test_item_meta(test_item: TTrackItem):
+    assert test_item.meta == TTrackItemMeta(file=Path("not-exists.txt"), line=10)
+
+
+def test_parse_stream_shares_file_id():
+    items = parse_stream(COMPACT_SOURCE.splitlines(), Path("shared.txt"))
+    assert len({item.source >> 32 for item in items}) == 1
+    assert [item.meta.line for item in items][:2] == [2, 3]
+    assert all(item.meta.file == Path("shared.txt") for item in items)
+
+
+def test_parse_stream_cache_rebinds_date():
+    source = """\
+2024-07-08 15m hello
+2024-07-08 15m hello
+x 2024-07-09 15m hello
+* 15m hello
+2024-07-10
+  15m hello
+2024-07-11
+  15m hello
+"""
+    parse_item_cached.cache_clear()
+    items = parse_stream(source.splitlines(), Path("cached.txt"))
+    assert [item.date.day for item in items] == [8, 8, 9, 9, 10, 11]
+    assert [item.meta.line for item in items] == [1, 2, 3, 4, 6, 8]
+    assert [item.done for item in items] == [None, None, "x", None, None, None]
+    assert items[0].time is items[1].time
+    cache = parse_item_cached.cache_info()
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+GROUP_SOURCE = """\
+2024-07-08 1h work +bt @dev #a #b
+2024-07-31 30m other +tt #a
+2024-08-01 2h more +bt @dev
+2024-07-09 1h back in july +bt
+"""
+
+
+def test_group_items_unsorted_input():
+    items = parse_stream(GROUP_SOURCE.splitlines(), Path("group.txt"))
+    grouped = group_items(items, ["month"])
+    assert [format_group_key(["month"], key) for key in grouped] == [
+        "2024-07",
+        "2024-08",
+    ]
+    assert [len(group) for group in grouped.values()] == [3, 1]
+
+
+def test_aggregate_time_composite():
+    items = parse_stream(GROUP_SOURCE.splitlines(), Path("group.txt"))
+    totals = aggregate_time(items, parse_group("week,project"))
+    assert {format_group_key(["week", "project"], k): v for k, v in totals.items()} == {
+        "2024-W28 bt": timedelta(hours=2),
+        "2024-W31 bt": timedelta(hours=2),
+        "2024-W31 tt": timedelta(minutes=30),
+    }
+
+
+def test_aggregate_time_tags_fan_out():
+    items = parse_stream(GROUP_SOURCE.splitlines(), Path("group.txt"))
+    totals = aggregate_time(items, ["tag"])
+    assert totals == {
+        ("a",): timedelta(minutes=90),
+        ("b",): timedelta(hours=1),
+        (None,): timedelta(hours=3),
+    }
+
+
+def test_parse_group_unknown():
+    with pytest.raises(ValueError):
+        parse_group("month,nope")
+
+
+@pytest.fixture(name="language_server")
+def create_language_server():
+    vocabulary = TTrackVocabulary()
+    vocabulary.add_text("1h +bt @dev\n1h +bt @call #review\n2h +tt")
+    server = TTrackLanguageServer(vocabulary, today=date(2024, 7, 31))
+    server.handle(
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didOpen",
+            "params": {
+                "textDocument": {
+                    "uri": "file:///tmp/2024-07.txt",
+                    "text": "2024-07-08\n  1h work +bt\n  30m call +\n",
+                }
+            },
+        }
+    )
+    return server
+
+
+def test_language_server_completion(language_server: TTrackLanguageServer):
+    (response,) = language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "textDocument/completion",
+            "params": {
+                "textDocument": {"uri": "file:///tmp/2024-07.txt"},
+                "position": {"line": 2, "character": 12},
+            },
+        }
+    )
+    assert [item["label"] for item in response["result"]] == ["+bt", "+tt"]
+
+
+def test_language_server_change(language_server: TTrackLanguageServer):
+    (notification,) = language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didChange",
+            "params": {
+                "textDocument": {"uri": "file:///tmp/2024-07.txt"},
+                "contentChanges": [
+                    {
+                        "range": {
+                            "start": {"line": 1, "character": 0},
+                            "end": {"line": 1, "character": 0},
+                        },
+                        "text": "  >08:00\n",
+                    }
+                ],
+            },
+        }
+    )
+    (diagnostic,) = notification["params"]["diagnostics"]
+    assert diagnostic["range"]["start"]["line"] == 1
+    (response,) = language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "id": 2,
+            "method": "textDocument/inlayHint",
+            "params": {"textDocument": {"uri": "file:///tmp/2024-07.txt"}},
+        }
+    )
+    (hint,) = response["result"]
+    assert hint["position"]["line"] == 3
+    assert hint["label"] == "= 1h30m"
+
+
+def test_language_server_flagged_star_lines(language_server: TTrackLanguageServer):
+    (notification,) = language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didOpen",
+            "params": {
+                "textDocument": {
+                    "uri": "file:///tmp/2024-07b.txt",
+                    "text": "2024-07-20 1h a\nx * 10m b\n$ * 5m c\n",
+                }
+            },
+        }
+    )
+    assert notification["params"]["diagnostics"] == []
+    (response,) = language_server.handle(
+        {
+            "jsonrpc": "2.0",
+            "id": 2,
+            "method": "textDocument/inlayHint",
+            "params": {"textDocument": {"uri": "file:///tmp/2024-07b.txt"}},
+        }
+    )
+    (hint,) = response["result"]
+    assert hint["label"] == "= 1h15m"
+
+
+def test_language_server_serve():
+    body = json.dumps({"jsonrpc": "2.0", "id": 1, "method": "shutdown"}).encode()
+    exit_body = json.dumps({"jsonrpc": "2.0", "method": "exit"}).encode()
+    reader = io.BytesIO(
+        b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+        + b"Content-Length: %d\r\n\r\n%s" % (len(exit_body), exit_body)
+    )
+    writer = io.BytesIO()
+    server = TTrackLanguageServer(TTrackVocabulary())
+    server.serve(reader, writer)
+    assert not server.running
+    _, _, response = writer.getvalue().partition(b"\r\n\r\n")
+    assert json.loads(response) == {"jsonrpc": "2.0", "id": 1, "result": None}
+
+
+def test_language_server_survives_handler_errors():
+    messages = [
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didChange",
+            "params": {"textDocument": {"uri": "file:///unknown.txt"}},
+        },
+        {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "textDocument/completion",
+            "params": {
+                "textDocument": {"uri": "file:///unknown.txt"},
+                "position": {"line": 0, "character": 0},
+            },
+        },
+        {"jsonrpc": "2.0", "id": 2, "method": "shutdown"},
+        {"jsonrpc": "2.0", "method": "exit"},
+    ]
+    reader = io.BytesIO(
+        b"".join(
+            b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+            for body in (json.dumps(message).encode() for message in messages)
+        )
+    )
+    writer = io.BytesIO()
+    server = TTrackLanguageServer(TTrackVocabulary())
+    server.serve(reader, writer)
+    assert not server.running
+    responses = [
+        json.loads(part.split(b"\r\n\r\n", 1)[1])
+        for part in writer.getvalue().split(b"Content-Length")[1:]
+    ]
+    assert [response["id"] for response in responses] == [1, 2]
+    assert responses[0]["error"]["code"] == -32603
+
+
+@pytest.mark.parametrize("compression", (".gz", ".xz", ".bz2"))
+def test_archive_file(tmp_path: Path, compression: str):
+    timefile = tmp_path / "2024-07.txt"
+    timefile.write_text(COMPACT_SOURCE)
+    expected = [item.model_dump() for item in parse_file(timefile)]
+
+    archive = archive_file(timefile, compression)
+    assert archive.name == "2024-07.txt" + compression
+    assert not timefile.exists()
+    items = parse_file(archive)
+    assert [item.model_dump(exclude={"source"}) for item in items] == [
+        {key: value for key, value in item.items() if key != "source"}
+        for item in expected
+    ]
+    assert items[0].meta.file == archive
+    with pytest.raises(RuntimeError):
+        compact_file(archive)
+
+
+def test_rollup_team(tmp_path: Path):
+    root = tmp_path / "team"
+    (root / "alice" / "data").mkdir(parents=True)
+    (root / "bob").mkdir(parents=True)
+    (root / "alice" / "data" / "2024-07.txt").write_text(COMPACT_SOURCE)
+    (root / "bob" / "2024-07.txt").write_text("2024-07-08 1h hello +tt\n")
+    cachedir = tmp_path / "cache"
+    cachedir.mkdir()
+
+    rollups = rollup_team(root, cachedir)
+    assert list(rollups) == ["alice", "bob"]
+    assert rollups["alice"].time.total() == 75 * 60
+    assert rollups["alice"].worktime.total() == 4 * 3600
+    assert rollups["bob"].time == {(date(2024, 7, 8).toordinal(), "tt", False): 3600}
+
+    # unchanged users come from the cache, changed ones are parsed again
+    for cache_file in cachedir.iterdir():
+        cache_file.write_text(cache_file.read_text().replace("14400", "28800"))
+    (root / "bob" / "2024-07.txt").write_text("2024-07-08 2h hello +tt\n")
+    rollups = rollup_team(root, cachedir)
+    assert rollups["alice"].worktime.total() == 8 * 3600
+    assert rollups["bob"].time.total() == 7200
+
+
+def test_rollup_team_broken_cache(tmp_path: Path):
+    root = tmp_path / "team"
+    (root / "bob").mkdir(parents=True)
+    (root / "bob" / "2024-07.txt").write_text("2024-07-08 1h hello +tt\n")
+    cachedir = tmp_path / "cache"
+    cachedir.mkdir()
+    rollup_team(root, cachedir)
+    (cache_file,) = cachedir.iterdir()
+    cache_file.write_text(cache_file.read_text()[:20])
+
+    rollups = rollup_team(root, cachedir)
+    assert rollups["bob"].time.total() == 3600
+    assert json.loads(cache_file.read_text())["rollup"]
+    assert list(cachedir.iterdir()) == [cache_file]
+
+
+def test_rollup_team_file_selection(tmp_path: Path):
+    user_dir = tmp_path / "team" / "carol"
+    user_dir.mkdir(parents=True)
+    (user_dir / "2024-07.txt").write_text("2024-07-08 1h hello +tt\n")
+    (user_dir / "2024-07.txt.gz").write_bytes(
+        gzip.compress(b"2024-07-08 1h hello +tt\n")
+    )
+    (user_dir / "2024-06.txt.xz").write_bytes(lzma.compress(b"2024-06-03 2h old +tt\n"))
+    (user_dir / "README.txt").write_text("not a timefile\n")
+    (user_dir / "requirements.txt").write_text("pydantic\n")
+
+    rollups = rollup_team(tmp_path / "team")
+    assert rollups["carol"].time.total() == 3 * 3600
+    readme = rollup_team(tmp_path / "team", pattern="README.txt")
+    assert readme["carol"].time.total() == 0
+
+
+QUERY_SOURCE = """\
+2024-06-28 1h june +bt
+2024-07-01
+  $ 2h a +bt @dev #x
+  1h b +tt @dev
+$ 2024-07-08 30m c +bt @call #x
+x 2024-07-09 45m d +bt
+$ 2024-07-15 10:00-11:30 e +bt @dev
+$ 2024-08-01 1h f +bt
+2024-08-02 1h g +tt
+"""
+
+
+@pytest.fixture(name="query_index")
+def create_query_index():
+    return TTrackIndex(parse_stream(QUERY_SOURCE.splitlines(), Path("query.txt")))
+
+
+def test_query_plan(query_index: TTrackIndex):
+    query = TTrackQuery.parse(
+        "project=bt and billable and date>=2024-07 group by week sum time"
+    )
+    plan = TTrackQueryPlan(query, query_index)
+    totals = {
+        format_group_key(["week"], key): (row["sum time"], row["count"])
+        for key, row in plan.aggregate().items()
+    }
+    assert totals == {
+        "2024-W27": (timedelta(hours=2), 1),
+        "2024-W28": (timedelta(minutes=30), 1),
+        "2024-W29": (timedelta(minutes=90), 1),
+        "2024-W31": (timedelta(hours=1), 1),
+    }
+    assert [step.description for step in plan.steps] == [
+        "project index bt",
+        "filter billable",
+        "filter date >= 2024-07",
+        "aggregate sum time by week",
+    ]
+    assert [step.rows for step in plan.steps] == [6, 4, 4, 4]
+
+
+def test_query_plan_date_range(query_index: TTrackIndex):
+    plan = TTrackQueryPlan(TTrackQuery.parse("date=2024-08 and not done"), query_index)
+    assert plan.steps[0].description == "date range 2024-08-01 .. 2024-08-31"
+    assert [item.text_clean for item in plan.execute()] == ["f", "g"]
+
+
+def test_query_plan_date_not_equal(query_index: TTrackIndex):
+    plan = TTrackQueryPlan(TTrackQuery.parse("date != 2024-07"), query_index)
+    assert "not date" not in "\n".join(plan.explain())
+    assert "date != 2024-07" in "\n".join(plan.explain())
+    assert [item.text_clean for item in plan.execute()] == ["june", "f", "g"]
+    plan = TTrackQueryPlan(TTrackQuery.parse("not date != 2024-08"), query_index)
+    assert [item.text_clean for item in plan.execute()] == ["f", "g"]
+
+
+def test_query_plan_running_estimate(query_index: TTrackIndex):
+    plan = TTrackQueryPlan(
+        TTrackQuery.parse("project=bt and date >= 2024-06 and not done"), query_index
+    )
+    estimates = [step.estimate for step in plan.steps]
+    assert plan.steps[0].description == "project index bt"
+    assert estimates == sorted(estimates, reverse=True)
+    assert estimates[1] == estimates[0] * plan.filters[0][1]
+
+
+def test_query_plan_project_index(query_index: TTrackIndex):
+    plan = TTrackQueryPlan(TTrackQuery.parse("project=tt and date=2024"), query_index)
+    assert plan.steps[0].description == "project index tt"
+    assert [item.text_clean for item in plan.execute()] == ["b", "g"]
+
+
+def test_query_parse_errors():
+    with pytest.raises(TTrackQueryError):
+        TTrackQuery.parse("nope=1")
+    with pytest.raises(TTrackQueryError):
+        TTrackQuery.parse("date>=2024-13")
+    with pytest.raises(TTrackQueryError):
+        TTrackQuery.parse("billable group by fortnight")
+
+
+def test_ledger_balance(tmp_path: Path):
+    june = tmp_path / "2024-06.txt"
+    june.write_text("2024-06-28 10h friday\n")
+    july = tmp_path / "2024-07.txt"
+    july.write_text("2024-07-01 8h monday\n2024-07-31 9h wednesday\n")
+    august = tmp_path / "2024-08.txt"
+    august.write_text("2024-08-01 8h thursday\n")
+    ledger = TTrackLedger(timedelta(hours=8), range(5))
+    ledger.update([june, july, august])
+
+    # 23 workdays in july, 1h over on the first and last of them
+    assert ledger.balance(date(2024, 7, 1), date(2024, 7, 31)) == timedelta(
+        hours=17 - 23 * 8
+    )
+    assert ledger.balance(date(2024, 6, 28), date(2024, 8, 1)) == timedelta(
+        hours=2 + 17 - 23 * 8
+    )
+    assert len(ledger.prefix) == 2
+
+    # a change in august keeps the checkpoints of june and july
+    august.write_text("2024-08-01 9h thursday\n")
+    assert ledger.update([june, july, august]) == {2024 * 12 + 7}
+    assert len(ledger.prefix) == 2
+    assert ledger.balance(date(2024, 6, 28), date(2024, 8, 1)) == timedelta(
+        hours=3 + 17 - 23 * 8
+    )
+
+    restored = TTrackLedger.from_dict(ledger.to_dict(), timedelta(hours=8), range(5))
+    assert restored.update([june, july, august]) == set()
+    assert restored.balance(date(2024, 6, 28), date(2024, 8, 1)) == ledger.balance(
+        date(2024, 6, 28), date(2024, 8, 1)
+    )
+
+
+def test_sketch_quantiles_and_merge():
+    values = [random.Random(4).lognormvariate(7, 1) for _ in range(10_000)]
+    left, right, stats = TTrackSketch(), TTrackSketch(), TTrackStats()
+    for index, value in enumerate(values):
+        (left if index % 2 else right).add(value)
+        stats.add(value)
+    sketch = left.merge(right)
+    ordered = sorted(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.02)
+    assert len(sketch.buckets) < 2048
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.variance == pytest.approx(statistics.variance(values))
+
+
+def test_stats_merge():
+    halves = TTrackStats(), TTrackStats()
+    for value in range(100):
+        halves[value % 2].add(value)
+    merged = halves[0].merge(halves[1])
+    assert merged.count == 100
+    assert merged.mean == pytest.approx(49.5)
+    assert merged.variance == pytest.approx(statistics.variance(range(100)))
+
+
+def test_stats_files(tmp_path: Path):
+    july = tmp_path / "2024-07.txt"
+    july.write_text(QUERY_SOURCE)
+    cache_file = tmp_path / "stats.json"
+
+    result = stats_files([july], ["project"], cache_file=cache_file)
+    assert result[("bt",)]["entry"].count == 6
+    assert result[("bt",)]["daily"].count == 6
+    assert result[("tt",)]["entry"].mean == 3600
+
+    cached = stats_files([july], ["project"], cache_file=cache_file)
+    assert cached[("bt",)]["entry"].to_dict() == result[("bt",)]["entry"].to_dict()
+
+
+IMPORT_CSV = """\
+Project,Client,Description,Start date,Duration,Tags,Billable
+Big Customer,ACME Inc.,Planning   meeting,2024-07-09,01:15:00,"meeting, weekly",Yes
+Internal,,Review,2024-06-30,00:30:00,,No
+Big Customer,,Bugfix,2024-07-08,02:00:00,,No
+,,broken,07/08/2024,01:00:00,,
+Internal,,Standup,2024-07-09,900,,No
+"""
+
+
+def test_import_file(tmp_path: Path):
+    source = tmp_path / "export.csv"
+    source.write_text(IMPORT_CSV)
+    existing = tmp_path / "2024-07.txt"
+    existing.write_text("2024-07-01 1h existing")
+    rules = TTrackImportRules(projects={"big customer": "bt"}, billable_projects={"bt"})
+    diagnostics = []
+
+    written = import_file(
+        source,
+        rules,
+        lambda day: tmp_path / day.strftime("%Y-%m.txt"),
+        diagnostics,
+        chunk_size=2,
+    )
+
+    assert written == {existing: 3, tmp_path / "2024-06.txt": 1}
+    assert [(d.line, d.message) for d in diagnostics] == [
+        (5, "invalid date: '07/08/2024'")
+    ]
+    assert existing.read_text() == (
+        "2024-07-01 1h existing\n"
+        "2024-07-08\n"
+        "  $ 2h Bugfix +bt\n"
+        "2024-07-09\n"
+        "  $ 1h15m Planning meeting +bt @ACME_Inc #meeting #weekly\n"
+        "  15m Standup +Internal\n"
+    )
+    items = parse_file(existing)
+    assert [item.date.day for item in items] == [1, 8, 9, 9]
+
+
+def test_import_file_rounds_to_minutes(tmp_path: Path):
+    source = tmp_path / "export.jsonl"
+    source.write_text(
+        "".join(
+            json.dumps({"description": "d", "date": "2024-07-08", "duration": value})
+            + "\n"
+            for value in ("1:00:30", "0:00:29", 0, 89, "1:29:29")
+        )
+    )
+    target = tmp_path / "2024-07.txt"
+    diagnostics = []
+    import_file(source, TTrackImportRules(), lambda day: target, diagnostics)
+    assert [d.line for d in diagnostics] == [2, 3]
+    assert [item.time.time for item in parse_file(target)] == [
+        timedelta(minutes=61),
+        timedelta(minutes=1),
+        timedelta(minutes=89),
+    ]
+
+
+def test_import_file_refuses_archived_month(tmp_path: Path):
+    source = tmp_path / "export.jsonl"
+    source.write_text(
+        json.dumps({"description": "x", "date": "2024-06-03", "duration": 60}) + "\n"
+    )
+    (tmp_path / "2024-06.txt.gz").write_bytes(b"")
+    with pytest.raises(RuntimeError, match="archived"):
+        import_file(
+            source,
+            TTrackImportRules(),
+            lambda day: tmp_path / day.strftime("%Y-%m.txt"),
+            [],
+        )
+    assert not (tmp_path / "2024-06.txt").exists()
+
+
+PARALLEL_SOURCE = """\
+2024-07-08 1h a +bt
+bogus
+* 30m b
+2024-07-09
+  >08:00
+  1h c
+  <12:00
+* 15m d
+// comment
+$ 2024-07-10 2h e
+  2h indented without context
+2024-07-11 ... f
+"""
+
+
+@pytest.mark.parametrize("gil_enabled", (True, False))
+def test_parse_lines_parallel(monkeypatch, gil_enabled: bool):
+    # one chunk per top-level line
+    monkeypatch.setattr(timetrack, "PARALLEL_MIN_LINES", 0)
+    monkeypatch.setattr(timetrack, "PARALLEL_CHUNKS_PER_WORKER", 100)
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: gil_enabled)
+    lines = PARALLEL_SOURCE.splitlines() * 3
+    expected_diagnostics = []
+    expected = parse_stream(lines, Path("parallel.txt"), expected_diagnostics)
+
+    diagnostics = []
+    items = parse_lines_parallel(lines, Path("parallel.txt"), diagnostics, 2)
+
+    assert [item.model_dump() for item in items] == [
+        item.model_dump() for item in expected
+    ]
+    assert [item.meta for item in items] == [item.meta for item in expected]
+    assert diagnostics == expected_diagnostics
+    assert [d.line for d in diagnostics] == [2, 11, 14, 23, 26, 35]
+    assert items[1].date == date(2024, 7, 8)
+
+
+@pytest.mark.parametrize("with_ledger", (False, True))
+def test_summary_table_columns(tmp_path: Path, with_ledger: bool):
+    july = tmp_path / "2024-07.txt"
+    july.write_text("2024-07-01 8h monday\n2024-07-02 9h tuesday\n")
+    ledger = None
+    if with_ledger:
+        ledger = TTrackLedger(timedelta(hours=8), range(5))
+        ledger.update([july])
+    summary = SummaryTable(TTrackRepository(july), ledger, date(2024, 7, 1))
+    summary.load("all", "day")
+    assert len(summary.table.columns) == (11 if with_ledger else 10)
+    assert summary.table.columns[-1].header == ("balance" if with_ledger else "context")
+
+
+def test_format_stat_rounds_estimates():
+    sketch = TTrackSketch()
+    for _ in range(10):
+        sketch.add(1800)
+    assert format_stat(sketch.quantile(0.5)) == "30m"
+    assert format_stat(4475.3) == "1h15m"
+    assert format_stat(None) == ""
+
+
+def test_parse_file_parallel_by_lines(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(timetrack, "PARALLEL_MIN_LINES", 10)
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: False)
+    monkeypatch.setattr(os, "process_cpu_count", lambda: 2)
+    split = []
+    split_chunks = timetrack.split_chunks
+    monkeypatch.setattr(
+        timetrack,
+        "split_chunks",
+        lambda lines, count: split.append(count) or split_chunks(lines, count),
+    )
+    timefile = tmp_path / "2024-07.txt"
+    timefile.write_text(PARALLEL_SOURCE * 2)
+    archive = archive_file(timefile, ".xz")
+
+    items = parse_file(archive, [])
+    assert split and len(items) == 16
+    # pool workers parse their file sequentially
+    split.clear()
+    check_file(archive, date(2024, 7, 31), max_workers=1)
+    assert not split